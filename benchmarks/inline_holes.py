@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''
+Scaling benchmark: inlining holes into their container polygon.
+
+Times PolygonSegment.inline (bridge candidates tried closest first, and
+checked against the edges found through a grid index) against two former
+searches, on a square pour with a growing number of round holes:
+
+- legacy: the search as it was before the grid index, with candidates tried
+  in point order and each one checked against every edge of every hole,
+  one LineSegment test per edge (copied below, as it left the exporter);
+- batched: the same brute force order, with each candidate checked against
+  every edge in one EdgeSet pass.
+
+usage: python benchmarks/inline_holes.py [MAX_HOLES_PER_SIDE] [REPEAT]
+'''
+
+from __future__ import print_function
+
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import svg2mod.svg as svg
+from svg_to_shenzhen import PolygonSegment
+
+
+class LineSegment(object):
+    '''The segment intersection test of the exporter before EdgeSet'''
+
+    @staticmethod
+    def _on_segment(p, q, r):
+        '''Given three colinear points p, q, and r, check if point q lies on
+           line segment pr'''
+        return (min(p.x, r.x) <= q.x <= max(p.x, r.x) and
+                min(p.y, r.y) <= q.y <= max(p.y, r.y))
+
+    @staticmethod
+    def _orientation(p, q, r):
+        '''0: colinear, 1: clockwise, 2: counterclockwise'''
+        val = (q.y - p.y) * (r.x - q.x) - (q.x - p.x) * (r.y - q.y)
+        if val == 0: return 0
+        if val > 0: return 1
+        return 2
+
+    def __init__(self, p=None, q=None):
+        self.p = p
+        self.q = q
+
+    def connects(self, segment):
+        for a in (self.p, self.q):
+            for b in (segment.p, segment.q):
+                if a.x == b.x and a.y == b.y:
+                    return True
+        return False
+
+    def intersects(self, segment):
+        o1 = self._orientation(self.p, self.q, segment.p)
+        o2 = self._orientation(self.p, self.q, segment.q)
+        o3 = self._orientation(segment.p, segment.q, self.p)
+        o4 = self._orientation(segment.p, segment.q, self.q)
+        return ((o1 != o2 and o3 != o4) or
+                (o1 == 0 and self._on_segment(self.p, segment.p, self.q)) or
+                (o2 == 0 and self._on_segment(self.p, segment.q, self.q)) or
+                (o3 == 0 and self._on_segment(segment.p, self.p, segment.q)) or
+                (o4 == 0 and self._on_segment(segment.p, self.q, segment.q)))
+
+    def q_next(self, q):
+        self.p = self.q
+        self.q = q
+
+
+def legacy_intersects(polygon, line_segment, check_connects):
+    '''PolygonSegment.intersects as it was before EdgeSet'''
+    hole_segment = LineSegment()
+    for point in polygon.points:
+        hole_segment.q_next(point)
+        if hole_segment.p is not None:
+            if check_connects and line_segment.connects(hole_segment):
+                continue
+            if line_segment.intersects(hole_segment):
+                return True
+    return False
+
+
+def legacy_find_insertion_point(self, hole, holes):
+    '''PolygonSegment._find_insertion_point as it was before _index_edges():
+       each bridge is checked against every edge of every hole'''
+    for cp in range(len(self.points)):
+        container_point = self.points[cp]
+        for hp in range(len(hole.points) - 1):
+            hole_point = hole.points[hp]
+            bridge = LineSegment(container_point, hole_point)
+            for other_hole in holes:
+                if legacy_intersects(
+                        other_hole, bridge,
+                        check_connects=(other_hole == hole or
+                                        other_hole == self)):
+                    break
+            else:
+                return (cp, hole.points_starting_on_index(hp))
+
+
+class LegacyPolygonSegment(PolygonSegment):
+
+    @staticmethod
+    def _index_edges(segments):
+        return segments
+
+    _find_insertion_point = legacy_find_insertion_point
+
+
+def batched_find_insertion_point(self, hole, edges):
+    '''The legacy search order, each bridge checked against every edge in
+       one EdgeSet pass'''
+    keys = range(len(edges))
+    for cp in range(len(self.points)):
+        container_point = self.points[cp]
+        for hp in range(len(hole.points) - 1):
+            hole_point = hole.points[hp]
+            if not edges.crosses(container_point.x, container_point.y,
+                                 hole_point.x, hole_point.y,
+                                 keys=keys, connecting=(hole, self)):
+                return (cp, hole.points_starting_on_index(hp))
+
+
+class BatchedPolygonSegment(PolygonSegment):
+
+    _find_insertion_point = batched_find_insertion_point
+
+
+def ring(cx, cy, r, n):
+    points = [svg.Point(cx + r * math.cos(2 * math.pi * i / n),
+                        cy + r * math.sin(2 * math.pi * i / n))
+              for i in range(n)]
+    return points + [svg.Point(points[0].x, points[0].y)]
+
+
+def pour(side, cls):
+    '''A square container with side x side round holes of 16 points'''
+    step = 10.0
+    size = side * step
+    # Points along each side of the square
+    n = 4 * side
+    container = ([svg.Point(size * i / n, 0) for i in range(n)] +
+                 [svg.Point(size, size * i / n) for i in range(n)] +
+                 [svg.Point(size - size * i / n, size) for i in range(n)] +
+                 [svg.Point(0, size - size * i / n) for i in range(n)])
+    container.append(svg.Point(0, 0))
+
+    holes = [cls(ring((i + 0.5) * step, (j + 0.5) * step, step / 4, 16))
+             for i in range(side) for j in range(side)]
+    return cls(container), holes
+
+
+def main():
+    max_side = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    # inline() reports its progress: keep the timings readable
+    stdout = sys.stdout
+    devnull = open(os.devnull, 'w')
+
+    print('{:>6} {:>12} {:>12} {:>12}'.format(
+        'holes', 'legacy', 'batched', 'inline'))
+    for side in range(1, max_side + 1):
+        times = []
+        for cls in (LegacyPolygonSegment, BatchedPolygonSegment,
+                    PolygonSegment):
+            container, holes = pour(side, cls)
+            sys.stdout = devnull
+            try:
+                best = min(timeit.repeat(lambda: container.inline(holes),
+                                         number=1, repeat=repeat))
+            finally:
+                sys.stdout = stdout
+            times.append(best)
+        print('{:>6} {:>9.1f} ms {:>9.1f} ms {:>9.1f} ms'.format(
+            side * side, times[0] * 1e3, times[1] * 1e3, times[2] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
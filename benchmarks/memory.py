@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''
+Memory benchmark: footprint of the parsed geometry.
+
+Parses every layer of an SVG file, materializes the geometry of each element
+and flattens it, reporting the memory traced by tracemalloc (Python 3 only)
+after each step, per element and per point.
+
+usage: python3 benchmarks/memory.py [FILE.svg] [PRECISION]
+'''
+
+import gc
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import svg2mod.svg as svg
+
+
+def leaves(group):
+    '''All the non-group elements below group'''
+    stack = [group]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (svg.Svg, svg.Group)):
+            stack.extend(item.items)
+        elif hasattr(item, 'segments'):
+            yield item
+
+
+def main():
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = glob.glob(os.path.join(
+            os.path.dirname(__file__), '..', 'dist', 'Neococo_*.svg'))[0]
+    precision = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+
+    image = svg.parse(filename)
+    parsed, _ = tracemalloc.get_traced_memory()
+
+    elements = list(leaves(image))
+    items = 0
+    for element in elements:
+        items += len(element.items) if isinstance(element, svg.Path) else 1
+    materialized, _ = tracemalloc.get_traced_memory()
+
+    segments = [element.segments(precision=precision) for element in elements]
+    points = sum(len(s) for polyline in segments for s in polyline)
+    flattened, peak = tracemalloc.get_traced_memory()
+
+    elapsed = time.time() - start
+    tracemalloc.stop()
+
+    print('{}: {} elements, {} path items, {} points (precision {})'.format(
+        os.path.basename(filename), len(elements), items, points, precision))
+    print('  parsed        {:8.1f} kB  {:6.0f} B/element'.format(
+        parsed / 1e3, parsed / float(len(elements))))
+    print('  materialized  {:8.1f} kB  {:6.0f} B/item'.format(
+        materialized / 1e3, (materialized - parsed) / float(max(items, 1))))
+    print('  flattened     {:8.1f} kB  {:6.0f} B/point'.format(
+        flattened / 1e3, (flattened - materialized) / float(max(points, 1))))
+    print('  peak          {:8.1f} kB  ({:.2f} s traced)'.format(
+        peak / 1e3, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+'''
+Micro-benchmark: SVG path data parsing.
+
+Compares Path.parse (single-pass tokenizer, numbers converted per command)
+against the former parser (one regex token list, popped one string at a
+time) on every <path> of an SVG file.
+
+usage: python benchmarks/path_parse.py [FILE.svg] [REPEAT]
+'''
+
+from __future__ import print_function
+
+import glob
+import os
+import re
+import sys
+import timeit
+import xml.etree.ElementTree as etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import svg2mod.svg as svg
+
+
+def legacy_parse(path, pathstr):
+    '''Path.parse as it was before tokenize_path()'''
+    COMMANDS = svg.COMMANDS
+    Point = svg.Point
+    pathlst = re.findall(svg.number_re + r"|\ *[%s]\ *" % COMMANDS, pathstr)
+    pathlst.reverse()
+
+    command = None
+    current_pt = Point(0,0)
+    start_pt = None
+
+    while pathlst:
+        if pathlst[-1].strip() in COMMANDS:
+            last_command = command
+            command = pathlst.pop().strip()
+            absolute = (command == command.upper())
+            command = command.upper()
+
+        if command == 'M':
+            pt = Point(pathlst.pop(), pathlst.pop())
+            if absolute: current_pt = pt
+            else: current_pt += pt
+            start_pt = current_pt
+            path.items.append(svg.MoveTo(current_pt))
+            command = 'L'
+        elif command == 'Z':
+            path.items.append(svg.Segment(current_pt, start_pt))
+        elif command in 'LHV':
+            if absolute: x,y = current_pt.coord()
+            else: x,y = (0,0)
+            if command in 'LH': x = pathlst.pop()
+            if command in 'LV': y = pathlst.pop()
+            pt = Point(x, y)
+            if not absolute: pt += current_pt
+            path.items.append(svg.Segment(current_pt, pt))
+            current_pt = pt
+        elif command in 'CQ':
+            bezier_pts = [current_pt]
+            for i in range(1, {'Q':3, 'C':4}[command]):
+                pt = Point(pathlst.pop(), pathlst.pop())
+                if not absolute: pt += current_pt
+                bezier_pts.append(pt)
+            path.items.append(svg.Bezier(bezier_pts))
+            current_pt = pt
+        elif command in 'TS':
+            bezier_pts = [current_pt]
+            if last_command in {'T': 'QT', 'S':'CS'}[command]:
+                pt0 = path.items[-1].control_point({'T':1, 'S':2}[command])
+            else:
+                pt0 = current_pt
+            bezier_pts.append(current_pt + current_pt - pt0)
+            for i in range(0, {'T':1, 'S':2}[command]):
+                pt = Point(pathlst.pop(), pathlst.pop())
+                if not absolute: pt += current_pt
+                bezier_pts.append(pt)
+            path.items.append(svg.Bezier(bezier_pts))
+            current_pt = pt
+        else:
+            pathlst.pop()
+
+
+def main():
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = glob.glob(os.path.join(
+            os.path.dirname(__file__), '..', 'dist', 'Neococo_*.svg'))[0]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    paths = [elt.get('d') for elt in etree.parse(filename).iter()
+             if elt.tag == svg.svg_ns + 'path' and elt.get('d')]
+    # Arcs are not handled by the legacy parser
+    paths = [d for d in paths if not re.search('[Aa]', d)]
+    size = sum(len(d) for d in paths)
+    print('{}: {} paths, {} bytes of path data, largest {} bytes'.format(
+        os.path.basename(filename), len(paths), size, max(len(d) for d in paths)))
+
+    def run(parse):
+        for d in paths:
+            parse(svg.Path(), d)
+
+    for name, parse in (('legacy', legacy_parse),
+                        ('tokenize_path', svg.Path.parse)):
+        best = min(timeit.repeat(lambda: run(parse), number=1, repeat=repeat))
+        print('  {:<14} {:8.1f} ms  {:6.1f} MB/s'.format(
+            name, best * 1e3, size / best / 1e6))
+
+
+if __name__ == '__main__':
+    main()
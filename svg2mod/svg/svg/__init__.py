@@ -1,8 +1,9 @@
 #__all__ = ['geometry', 'svg']
 
 from .svg import *
+from .polygon import *
 
-def parse(filename):
-    f = svg.Svg(filename)
+def parse(filename, layers=None):
+    f = svg.Svg(filename, layers)
     return f
 
@@ -23,7 +23,10 @@ import math
 import numbers
 import operator
 
-class Point:
+class Point(object):
+    # Points are by far the most numerous objects: no per-instance __dict__
+    __slots__ = ('x', 'y')
+
     def __init__(self, x=None, y=None):
         '''A Point is defined either by a tuple/list of length 2 or
            by 2 coordinates
@@ -38,6 +41,12 @@ class Point:
         >>> Point(('1', None))
         (1.000,0.000)
         '''
+        # Fast path: coordinates computed by geometry operations
+        if x.__class__ is float and y.__class__ is float:
+            self.x = x
+            self.y = y
+            return
+
         if (isinstance(x, tuple) or isinstance(x, list)) and len(x) == 2:
             x,y = x
 
@@ -58,6 +67,8 @@ class Point:
         (4.000,4.000)
         >>> Point(1,2) + (3,2)
         (4.000,4.000)'''
+        if other.__class__ is Point:
+            return Point(self.x + other.x, self.y + other.y)
         if not isinstance(other, Point):
             try: other = Point(other)
             except: return NotImplemented
@@ -68,6 +79,8 @@ class Point:
         >>> Point(1,2) - Point(3,2)
         (-2.000,0.000)
         '''
+        if other.__class__ is Point:
+            return Point(self.x - other.x, self.y - other.y)
         if not isinstance(other, Point):
             try: other = Point(other)
             except: return NotImplemented
@@ -95,6 +108,8 @@ class Point:
         >>> Point(1,2) == Point(2,1)
         False
         '''
+        if other.__class__ is Point:
+            return (self.x == other.x) and (self.y == other.y)
         if not isinstance(other, Point):
             try: other = Point(other)
             except: return NotImplemented
@@ -124,8 +139,10 @@ class Point:
         return Point(x,y)
 
 
-class Angle:
+class Angle(object):
     '''Define a trigonometric angle [of a vector] '''
+    __slots__ = ('angle', 'cos', 'sin')
+
     def __init__(self, arg):
         if isinstance(arg, numbers.Real):
         # We precompute sin and cos for rotations
@@ -151,8 +168,17 @@ class Angle:
     def __neg__(self):
         return Angle(Point(self.cos, -self.sin))
 
-class Segment:
+def offset_key(point, origin, quantum):
+    '''The offset of point from origin, in whole multiples of quantum: the
+       items of translated copies of a shape have the same keys (unless
+       rounding falls on different sides of a multiple)'''
+    return (int(round((point.x - origin.x) / quantum)),
+            int(round((point.y - origin.y) / quantum)))
+
+class Segment(object):
     '''A segment is an object defined by 2 points'''
+    __slots__ = ('start', 'end')
+
     def __init__(self, start, end):
         self.start = start
         self.end = end
@@ -160,7 +186,7 @@ class Segment:
     def __str__(self):
         return 'Segment from ' + str(self.start) + ' to ' + str(self.end)
 
-    def segments(self, precision=0):
+    def segments(self, precision=0, tolerance=None):
         ''' Segments is simply the segment start -> end'''
         return [self.start, self.end]
 
@@ -198,6 +224,11 @@ class Segment:
 
         return (Point(xmin,ymin),Point(xmax,ymax))
 
+    def shape_key(self, origin, quantum):
+        '''Hashable geometry relative to origin, see offset_key()'''
+        return ('L', offset_key(self.start, origin, quantum),
+                offset_key(self.end, origin, quantum))
+
     def transform(self, matrix):
         self.start = matrix * self.start
         self.end = matrix * self.end
@@ -212,12 +243,14 @@ class Segment:
         self.start = self.start.rot(angle)
         self.end = self.end.rot(angle)
 
-class Bezier:
+class Bezier(object):
     '''Bezier curve class
        A Bezier curve is defined by its control points
        Its dimension is equal to the number of control points
        Note that SVG only support dimension 3 and 4 Bezier curve, respectively
        Quadratic and Cubic Bezier curve'''
+    __slots__ = ('pts', 'dimension')
+
     def __init__(self, pts):
         self.pts = list(pts)
         self.dimension = len(pts)
@@ -243,8 +276,30 @@ class Bezier:
             p1 = p2
         return l
 
+    def P(self, t):
+        '''Return the Point of the curve for t in [0..1] (de Casteljau)'''
+        pts = [(p.x, p.y) for p in self.pts]
+        s = 1 - t
+        while len(pts) > 1:
+            pts = [(s * xa + t * xb, s * ya + t * yb)
+                   for (xa, ya), (xb, yb) in zip(pts[:-1], pts[1:])]
+        return Point(pts[0])
+
     def bbox(self):
-        return self.rbbox()
+        '''Exact bounding box: ends of the curve, and points of the curve
+        where the derivative of x or y cancels'''
+        if self.dimension not in (3, 4):
+            return self.rbbox()
+
+        xs = [self.pts[0].x, self.pts[-1].x]
+        ys = [self.pts[0].y, self.pts[-1].y]
+        for coords in ([p.x for p in self.pts], [p.y for p in self.pts]):
+            for t in bezier_extrema(coords):
+                p = self.P(t)
+                xs.append(p.x)
+                ys.append(p.y)
+
+        return (Point(min(xs), min(ys)), Point(max(xs), max(ys)))
 
     def rbbox(self):
         '''Rough bounding box: return the bounding box (P1,P2) of the Bezier
@@ -256,10 +311,20 @@ class Bezier:
 
         return (Point(xmin,ymin), Point(xmax,ymax))
 
-    def segments(self, precision=0):
+    def segments(self, precision=0, tolerance=None):
         '''Return a polyline approximation ("segments") of the Bezier curve
-           precision is the minimum significative length of a segment'''
-        segments = []
+           precision is the minimum significative length of a segment
+           If tolerance is given, the curve is subdivided adaptively instead,
+           until no point of the curve is further than tolerance from the
+           polyline'''
+        return [Point(x, y) for x, y in self.coords(precision, tolerance)]
+
+    def coords(self, precision=0, tolerance=None):
+        '''Same as segments(), as a list of (x, y) coordinates: all points
+           are evaluated at once from precomputed Bernstein coefficients'''
+        if tolerance is not None:
+            return self._subdivide(tolerance)
+
         # n is the number of Bezier points to draw according to precision
         if precision != 0:
             n = int(self.rlength() / precision) + 1
@@ -268,31 +333,78 @@ class Bezier:
         #if n < 10: n = 10
         if n > 1000 : n = 1000
 
-        for t in range(0, n+1):
-            segments.append(self._bezierN(float(t)/n))
-        return segments
-
-    def _bezier1(self, p0, p1, t):
-        '''Bezier curve, one dimension
-        Compute the Point corresponding to a linear Bezier curve between
-        p0 and p1 at "time" t '''
-        pt = p0 + t * (p1 - p0)
-        return pt
-
-    def _bezierN(self, t):
-        '''Bezier curve, Nth dimension
-        Compute the point of the Nth dimension Bezier curve at "time" t'''
-        # We reduce the N Bezier control points by computing the linear Bezier
-        # point of each control point segment, creating N-1 control points
-        # until we reach one single point
-        res = list(self.pts)
-        # We store the resulting Bezier points in res[], recursively
-        for n in range(self.dimension, 1, -1):
-            # For each control point of nth dimension,
-            # compute linear Bezier point a t
-            for i in range(0,n-1):
-                res[i] = self._bezier1(res[i], res[i+1], t)
-        return res[0]
+        weights = bernstein(self.dimension, n)
+        xs = [p.x for p in self.pts]
+        ys = [p.y for p in self.pts]
+
+        if self.dimension == 4:
+            x0, x1, x2, x3 = xs
+            y0, y1, y2, y3 = ys
+            return [(w0 * x0 + w1 * x1 + w2 * x2 + w3 * x3,
+                     w0 * y0 + w1 * y1 + w2 * y2 + w3 * y3)
+                    for w0, w1, w2, w3 in weights]
+        if self.dimension == 3:
+            x0, x1, x2 = xs
+            y0, y1, y2 = ys
+            return [(w0 * x0 + w1 * x1 + w2 * x2, w0 * y0 + w1 * y1 + w2 * y2)
+                    for w0, w1, w2 in weights]
+        return [(sum(map(operator.mul, w, xs)), sum(map(operator.mul, w, ys)))
+                for w in weights]
+
+    def _subdivide(self, tolerance, max_depth=16):
+        '''Adaptive flattening: split the curve in halves (de Casteljau)
+           until the control points of each piece are within tolerance of its
+           chord (the segment, not its line): the piece lies in the convex
+           hull of its control points, so no point of it is further than
+           tolerance from the chord'''
+        tolerance2 = tolerance * tolerance
+        pts = [(p.x, p.y) for p in self.pts]
+        coords = [pts[0]]
+        # Pieces still to flatten, the next one (in curve order) on top
+        stack = [(pts, 0)]
+        while stack:
+            pts, depth = stack.pop()
+            (x0, y0), (x1, y1) = pts[0], pts[-1]
+            dx = x1 - x0
+            dy = y1 - y0
+            chord2 = dx * dx + dy * dy
+            flat = True
+            for x, y in pts[1:-1]:
+                # Projection on the chord, scaled by chord2
+                dot = (x - x0) * dx + (y - y0) * dy
+                if dot <= 0:
+                    # Closest to the start of the chord
+                    flat = (x - x0) ** 2 + (y - y0) ** 2 <= tolerance2
+                elif dot >= chord2:
+                    # Closest to its end
+                    flat = (x - x1) ** 2 + (y - y1) ** 2 <= tolerance2
+                else:
+                    # Squared distance to the chord line, scaled by chord2
+                    cross = (x - x0) * dy - (y - y0) * dx
+                    flat = cross * cross <= tolerance2 * chord2
+                if not flat:
+                    break
+
+            if flat or depth >= max_depth:
+                coords.append(pts[-1])
+                continue
+
+            left = [pts[0]]
+            right = [pts[-1]]
+            while len(pts) > 1:
+                pts = [((xa + xb) * 0.5, (ya + yb) * 0.5)
+                       for (xa, ya), (xb, yb) in zip(pts[:-1], pts[1:])]
+                left.append(pts[0])
+                right.append(pts[-1])
+            right.reverse()
+            stack.append((right, depth + 1))
+            stack.append((left, depth + 1))
+
+        return coords
+
+    def shape_key(self, origin, quantum):
+        '''Hashable geometry relative to origin, see offset_key()'''
+        return ('C',) + tuple(offset_key(p, origin, quantum) for p in self.pts)
 
     def transform(self, matrix):
         self.pts = [matrix * x for x in self.pts]
@@ -304,13 +416,241 @@ class Bezier:
     def rotate(self, angle):
         self.pts = [x.rot(angle) for x in self.pts]
 
-class MoveTo:
+class Arc(object):
+    '''Elliptical arc, built from the endpoint parameterization of the SVG
+       path A command (F.6.5 of the SVG 1.1 implementation notes)
+       It is stored in center parameterization: the arc is the set of points
+       center + u.cos(t) + v.sin(t) for t from theta to theta + dtheta, where
+       u and v are the (rotated) semi-axis vectors of the ellipse'''
+    __slots__ = ('start', 'end', 'center', 'u', 'v', 'theta', 'dtheta')
+
+    def __init__(self, start, rx, ry, xrot, large_arc, sweep, end):
+        self.start = start
+        self.end = end
+
+        phi = math.radians(xrot)
+        cosphi = math.cos(phi)
+        sinphi = math.sin(phi)
+        rx = abs(rx)
+        ry = abs(ry)
+
+        # Midpoint in the ellipse frame
+        dx = (start.x - end.x) / 2.0
+        dy = (start.y - end.y) / 2.0
+        x1 = cosphi * dx + sinphi * dy
+        y1 = -sinphi * dx + cosphi * dy
+
+        # Radii too small to join both ends are scaled up (F.6.6)
+        scale = (x1 / rx) ** 2 + (y1 / ry) ** 2
+        if scale > 1:
+            rx *= math.sqrt(scale)
+            ry *= math.sqrt(scale)
+
+        num = (rx * ry) ** 2 - (rx * y1) ** 2 - (ry * x1) ** 2
+        den = (rx * y1) ** 2 + (ry * x1) ** 2
+        k = math.sqrt(max(0.0, num / den)) if den else 0.0
+        if bool(large_arc) == bool(sweep):
+            k = -k
+        cx1 = k * rx * y1 / ry
+        cy1 = -k * ry * x1 / rx
+
+        self.center = Point(cosphi * cx1 - sinphi * cy1 + (start.x + end.x) / 2.0,
+                            sinphi * cx1 + cosphi * cy1 + (start.y + end.y) / 2.0)
+        self.u = Point(rx * cosphi, rx * sinphi)
+        self.v = Point(-ry * sinphi, ry * cosphi)
+
+        self.theta = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+        dtheta = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - self.theta
+        if sweep and dtheta < 0:
+            dtheta += 2 * math.pi
+        elif not sweep and dtheta > 0:
+            dtheta -= 2 * math.pi
+        self.dtheta = dtheta
+
+    def __str__(self):
+        return 'Arc from ' + str(self.start) + ' to ' + str(self.end) + \
+                ' around ' + str(self.center)
+
+    def P(self, t):
+        '''Return the Point of the ellipse at angle t'''
+        cost = math.cos(t)
+        sint = math.sin(t)
+        return Point(self.center.x + self.u.x * cost + self.v.x * sint,
+                     self.center.y + self.u.y * cost + self.v.y * sint)
+
+    def radius(self):
+        '''Largest radius of the (possibly transformed) ellipse'''
+        # Largest singular value of the [u v] matrix
+        s = self.u.x ** 2 + self.u.y ** 2 + self.v.x ** 2 + self.v.y ** 2
+        det = self.u.x * self.v.y - self.u.y * self.v.x
+        return math.sqrt((s + math.sqrt(max(0.0, s ** 2 - 4 * det ** 2))) / 2)
+
+    def _in_sweep(self, t):
+        '''Whether angle t is swept by the arc'''
+        if self.dtheta >= 0:
+            return (t - self.theta) % (2 * math.pi) <= self.dtheta
+        return (self.theta - t) % (2 * math.pi) <= -self.dtheta
+
+    def bbox(self):
+        '''Exact bounding box: ends of the arc, and extrema of the ellipse
+        (where the derivative of x or y cancels) swept by the arc'''
+        xs = [self.start.x, self.end.x]
+        ys = [self.start.y, self.end.y]
+        tx = math.atan2(self.v.x, self.u.x)
+        ty = math.atan2(self.v.y, self.u.y)
+        for t in (tx, tx + math.pi, ty, ty + math.pi):
+            if self._in_sweep(t):
+                p = self.P(t)
+                xs.append(p.x)
+                ys.append(p.y)
+
+        return (Point(min(xs), min(ys)), Point(max(xs), max(ys)))
+
+    def segments(self, precision=0, tolerance=None):
+        '''Return a polyline approximation ("segments") of the Arc
+           precision is the maximum distance between a chord and the arc
+           (sagitta), chords spanning at most a quarter turn
+           tolerance, if given, is used instead of precision'''
+        if tolerance is not None:
+            precision = tolerance
+        n = chord_count(self.dtheta, self.radius(), precision)
+
+        segments = [self.start]
+        for i in range(1, n):
+            segments.append(self.P(self.theta + self.dtheta * i / n))
+        segments.append(self.end)
+        return segments
+
+    def shape_key(self, origin, quantum):
+        '''Hashable geometry relative to origin, see offset_key()'''
+        zero = Point(0, 0)
+        return ('A', offset_key(self.start, origin, quantum),
+                offset_key(self.end, origin, quantum),
+                offset_key(self.center, origin, quantum),
+                offset_key(self.u, zero, quantum),
+                offset_key(self.v, zero, quantum),
+                round(self.theta, 9), round(self.dtheta, 9))
+
+    def transform(self, matrix):
+        origin = matrix * Point(0, 0)
+        self.u = matrix * self.u - origin
+        self.v = matrix * self.v - origin
+        self.center = matrix * self.center
+        self.start = matrix * self.start
+        self.end = matrix * self.end
+
+    def scale(self, ratio):
+        self.center *= ratio
+        self.u *= ratio
+        self.v *= ratio
+        self.start *= ratio
+        self.end *= ratio
+    def translate(self, offset):
+        self.center += offset
+        self.start += offset
+        self.end += offset
+    def rotate(self, angle):
+        self.center = self.center.rot(angle)
+        self.u = self.u.rot(angle)
+        self.v = self.v.rot(angle)
+        self.start = self.start.rot(angle)
+        self.end = self.end.rot(angle)
+
+def chord_count(angle, radius, precision):
+    '''Number of chords approximating an arc of the given angle (radians) and
+       radius, so that no chord is further than precision from the arc
+       (sagitta), nor spans more than a quarter turn'''
+    if precision <= 0:
+        return 1000
+    if precision < radius:
+        step = 2 * math.acos(1 - float(precision) / radius)
+    else:
+        step = math.pi / 2
+    n = int(math.ceil(abs(angle) / step))
+    return min(max(n, 1), 1000)
+
+def bezier_extrema(coords):
+    '''Values of t in ]0, 1[ where the derivative of one coordinate of a
+       quadratic or cubic Bezier curve cancels, given that coordinate of
+       its control points'''
+    if len(coords) == 3:
+        p0, p1, p2 = coords
+        d = p0 - 2 * p1 + p2
+        roots = [float(p0 - p1) / d] if d else []
+    else:
+        p0, p1, p2, p3 = coords
+        # Derivative divided by 3: a.t^2 + b.t + c
+        a = -p0 + 3 * p1 - 3 * p2 + p3
+        b = 2 * (p0 - 2 * p1 + p2)
+        c = p1 - p0
+        if a == 0:
+            roots = [-float(c) / b] if b else []
+        else:
+            disc = b * b - 4 * a * c
+            if disc < 0:
+                return []
+            # Numerically stable form of the quadratic roots
+            q = -0.5 * (b + math.copysign(math.sqrt(disc), b))
+            roots = [q / a]
+            if q:
+                roots.append(c / q)
+    return [t for t in roots if 0 < t < 1]
+
+# Unit circle points already computed, by number of points
+_unit_circle_cache = {}
+
+def unit_circle(n):
+    '''(cos, sin) of n angles evenly spread over a full turn, from 0'''
+    points = _unit_circle_cache.get(n)
+    if points is None:
+        step = 2 * math.pi / n
+        points = [(math.cos(i * step), math.sin(i * step)) for i in range(n)]
+        if len(_unit_circle_cache) > 256:
+            _unit_circle_cache.clear()
+        _unit_circle_cache[n] = points
+    return points
+
+# Bernstein coefficients already computed, by (dimension, n)
+_bernstein_cache = {}
+
+def bernstein(dimension, n):
+    '''Bernstein coefficients of a Bezier curve with dimension control
+       points, for t = 0, 1/n, ..., 1: one tuple of weights per value of t'''
+    weights = _bernstein_cache.get((dimension, n))
+    if weights is not None:
+        return weights
+
+    degree = dimension - 1
+    binomial = [1]
+    for i in range(degree):
+        binomial.append(binomial[-1] * (degree - i) // (i + 1))
+
+    weights = []
+    for j in range(n + 1):
+        t = float(j) / n
+        s = 1 - t
+        weights.append(tuple(binomial[i] * t ** i * s ** (degree - i)
+                             for i in range(dimension)))
+
+    # n depends on the curve length: keep the cache bounded
+    if len(_bernstein_cache) > 256:
+        _bernstein_cache.clear()
+    _bernstein_cache[(dimension, n)] = weights
+    return weights
+
+class MoveTo(object):
+    __slots__ = ('dest',)
+
     def __init__(self, dest):
         self.dest = dest
 
     def bbox(self):
         return (self.dest, self.dest)
 
+    def shape_key(self, origin, quantum):
+        '''Hashable geometry relative to origin, see offset_key()'''
+        return ('M', offset_key(self.dest, origin, quantum))
+
     def transform(self, matrix):
         self.dest = matrix * self.dest
 
@@ -323,21 +663,43 @@ class MoveTo:
 
 
 def simplify_segment(segment, epsilon):
-    '''Ramer-Douglas-Peucker algorithm'''
-    if len(segment) < 3 or epsilon <= 0:
+    '''Ramer-Douglas-Peucker algorithm
+       The ranges of points still to simplify are kept on an explicit stack
+       rather than recursed into, so there is no limit on the polyline size'''
+    n = len(segment)
+    if n < 3 or epsilon <= 0:
         return segment[:]
 
-    l = Segment(segment[0], segment[-1]) # Longest segment
-
-    # Find the furthest point from the segment
-    index, maxDist = max([(i, l.pdistance(p)) for i,p in enumerate(segment)],
-            key=operator.itemgetter(1))
-
-    if maxDist > epsilon:
-        # Recursively call with segment splited in 2 on its furthest point
-        r1 = simplify_segment(segment[:index+1], epsilon)
-        r2 = simplify_segment(segment[index:], epsilon)
-        # Remove redundant 'middle' Point
-        return r1[:-1] + r2
-    else:
-        return [segment[0], segment[-1]]
+    xs = [p.x for p in segment]
+    ys = [p.y for p in segment]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        x0, y0 = xs[first], ys[first]
+        dx = xs[last] - x0
+        dy = ys[last] - y0
+        inner = zip(xs[first+1:last], ys[first+1:last])
+        if dx or dy:
+            # Distances to the (first, last) line, times the segment length
+            dists = [abs((x - x0) * dy - (y - y0) * dx) for x, y in inner]
+            threshold = epsilon * math.sqrt(dx * dx + dy * dy)
+        else:
+            # Closed range: squared distances to its end point
+            dists = [(x - x0) ** 2 + (y - y0) ** 2 for x, y in inner]
+            threshold = epsilon * epsilon
+
+        # Split on the furthest point, if it is not close enough
+        dmax = max(dists)
+        if dmax > threshold:
+            index = first + 1 + dists.index(dmax)
+            keep[index] = True
+            stack.append((index, last))
+            stack.append((first, index))
+
+    return [p for p, k in zip(segment, keep) if k]
@@ -0,0 +1,903 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+'''
+This module contains the algorithms working on whole polygons (lists of
+rings, each a list of Points): spatial indexing of their edges, nesting of
+their rings, union, and topology preserving simplification.
+'''
+
+import bisect
+import heapq
+import math
+
+from .geometry import Point
+
+__all__ = ['SegmentGrid', 'EdgeSet', 'segments_intersect', 'nearest_pairs',
+           'simplify_polygon', 'self_intersections', 'signed_area', 'nest_rings',
+           'union_polygons']
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    '''Sign of the cross product (b - a) x (c - a): 1 if a, b, c turn left,
+       -1 if they turn right, 0 if they are aligned'''
+    cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (cross > 0) - (cross < 0)
+
+def _on_segment(ax, ay, bx, by, cx, cy):
+    '''Whether c, aligned with a and b, lies between them'''
+    return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Whether segments [a, b] and [c, d] have at least one common point
+
+        >>> segments_intersect(0,0, 2,2, 0,2, 2,0)
+        True
+        >>> segments_intersect(0,0, 1,0, 1,0, 1,1)
+        True
+        >>> segments_intersect(0,0, 2,0, 1,0, 3,0)
+        True
+        >>> segments_intersect(0,0, 1,0, 2,0, 3,0)
+        False
+    '''
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+
+    if o1 != o2 and o3 != o4 and o1 and o2 and o3 and o4:
+        return True
+
+    # Touching or collinear cases
+    return ((o1 == 0 and _on_segment(ax, ay, bx, by, cx, cy)) or
+            (o2 == 0 and _on_segment(ax, ay, bx, by, dx, dy)) or
+            (o3 == 0 and _on_segment(cx, cy, dx, dy, ax, ay)) or
+            (o4 == 0 and _on_segment(cx, cy, dx, dy, bx, by)))
+
+
+class SegmentGrid(object):
+    '''Spatial index of segments: a uniform grid of square cells, each
+       holding the keys of the segments crossing it
+       Segments are registered column by column, in the cells they actually
+       cross rather than in all the cells of their bounding box'''
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        # Coordinates (x0, y0, x1, y1) of each segment, by key
+        self.segments = {}
+
+    @classmethod
+    def from_segments(cls, segments):
+        '''A grid holding the given (x0, y0, x1, y1) segments, keyed by
+           their index, with cells about twice as large as their mean length
+           (and no more than 1024 cells across their bounding box)'''
+        segments = list(segments)
+        if not segments:
+            return cls(1.0)
+        xs = [x for x0, y0, x1, y1 in segments for x in (x0, x1)]
+        ys = [y for x0, y0, x1, y1 in segments for y in (y0, y1)]
+        extent = max(max(xs) - min(xs), max(ys) - min(ys))
+        length = sum(math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+                     for x0, y0, x1, y1 in segments)
+        size = max(2 * length / len(segments), extent / 1024.0)
+
+        grid = cls(size if size > 0 else 1.0)
+        for key, segment in enumerate(segments):
+            grid.insert(key, *segment)
+        return grid
+
+    def _column_cells(self, x0, y0, x1, y1):
+        '''Keys (i, j) of the cells crossed by a segment'''
+        size = self.cell_size
+        # Cells touching a crossing point on their border are included
+        margin = size * 1e-9
+        if x0 > x1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        i0 = int(math.floor((x0 - margin) / size))
+        i1 = int(math.floor((x1 + margin) / size))
+        slope = float(y1 - y0) / (x1 - x0) if x1 > x0 else None
+        for i in range(i0, i1 + 1):
+            # Part of the segment within column i
+            if slope is None:
+                ya, yb = y0, y1
+            else:
+                ya = y0 + slope * (max(x0, i * size) - x0)
+                yb = y0 + slope * (min(x1, (i + 1) * size) - x0)
+            j0 = int(math.floor((min(ya, yb) - margin) / size))
+            j1 = int(math.floor((max(ya, yb) + margin) / size))
+            for j in range(j0, j1 + 1):
+                yield (i, j)
+
+    def insert(self, key, x0, y0, x1, y1):
+        self.segments[key] = (x0, y0, x1, y1)
+        for cell in self._column_cells(x0, y0, x1, y1):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        for cell in self._column_cells(*self.segments.pop(key)):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def query(self, xmin, ymin, xmax, ymax):
+        '''Keys of the segments which may meet the given box'''
+        size = self.cell_size
+        found = set()
+        for i in range(int(math.floor(xmin / size)),
+                       int(math.floor(xmax / size)) + 1):
+            for j in range(int(math.floor(ymin / size)),
+                           int(math.floor(ymax / size)) + 1):
+                keys = self.cells.get((i, j))
+                if keys:
+                    found.update(keys)
+        return found
+
+    def near(self, x0, y0, x1, y1):
+        '''Keys of the segments sharing a cell with [(x0, y0), (x1, y1)]:
+           all the ones it may meet'''
+        cells = self.cells
+        found = set()
+        for cell in self._column_cells(x0, y0, x1, y1):
+            keys = cells.get(cell)
+            if keys:
+                found.update(keys)
+        return found
+
+    def crossing(self, x0, y0, x1, y1):
+        '''Keys of the segments having a common point with [(x0, y0),
+           (x1, y1)]'''
+        return [key for key in self.near(x0, y0, x1, y1)
+                if segments_intersect(x0, y0, x1, y1, *self.segments[key])]
+
+
+class EdgeSet(object):
+    '''Edges of polygons, kept as plain coordinate lists (exact for integer
+       coordinates), each tagged with the ring it belongs to, and tested
+       against a segment all at once
+       Once index() is called, only the edges sharing a grid cell with the
+       segment are tested.'''
+    def __init__(self):
+        self.x0 = []
+        self.y0 = []
+        self.x1 = []
+        self.y1 = []
+        self.owners = []
+        self.grid = None
+
+    def add(self, x0, y0, x1, y1, owner=None):
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.owners.append(owner)
+        return len(self.owners) - 1
+
+    def add_ring(self, points, owner=None):
+        '''Add the edges between consecutive Points'''
+        for i in range(1, len(points)):
+            self.add(points[i - 1].x, points[i - 1].y,
+                     points[i].x, points[i].y, owner)
+
+    def index(self):
+        self.grid = SegmentGrid.from_segments(
+            zip(self.x0, self.y0, self.x1, self.y1))
+        return self
+
+    def __len__(self):
+        return len(self.owners)
+
+    def crossing(self, ax, ay, bx, by, keys=None, connecting=()):
+        '''Iterate over the keys of the edges having a common point with
+           [a, b], among keys (the edges near [a, b] by default)
+           Edges of the owners in connecting are skipped when they share an
+           end with [a, b]: a bridge may leave from, and arrive on, the rings
+           it connects.'''
+        if keys is None:
+            if self.grid is not None:
+                keys = self.grid.near(ax, ay, bx, by)
+            else:
+                keys = range(len(self.owners))
+        xs0, ys0, xs1, ys1 = self.x0, self.y0, self.x1, self.y1
+        owners = self.owners
+        xmin, xmax = (ax, bx) if ax < bx else (bx, ax)
+        ymin, ymax = (ay, by) if ay < by else (by, ay)
+        ux = bx - ax
+        uy = by - ay
+
+        for key in keys:
+            cx = xs0[key]
+            dx = xs1[key]
+            if (cx < xmin and dx < xmin) or (cx > xmax and dx > xmax):
+                continue
+            cy = ys0[key]
+            dy = ys1[key]
+            if (cy < ymin and dy < ymin) or (cy > ymax and dy > ymax):
+                continue
+            if connecting and owners[key] in connecting and (
+                    (cx == bx and cy == by) or (dx == bx and dy == by) or
+                    (cx == ax and cy == ay) or (dx == ax and dy == ay)):
+                continue
+
+            # Orientations of c and d relative to [a, b], and of a and b
+            # relative to [c, d]
+            vx = dx - cx
+            vy = dy - cy
+            o1 = uy * (cx - bx) - ux * (cy - by)
+            o2 = uy * (dx - bx) - ux * (dy - by)
+            o3 = vy * (ax - dx) - vx * (ay - dy)
+            o4 = vy * (bx - dx) - vx * (by - dy)
+            o1 = (o1 > 0) - (o1 < 0)
+            o2 = (o2 > 0) - (o2 < 0)
+            o3 = (o3 > 0) - (o3 < 0)
+            o4 = (o4 > 0) - (o4 < 0)
+
+            if o1 != o2 and o3 != o4:
+                yield key
+            # Collinear cases: an end of one segment lies on the other
+            elif ((o1 == 0 and xmin <= cx <= xmax and ymin <= cy <= ymax) or
+                  (o2 == 0 and xmin <= dx <= xmax and ymin <= dy <= ymax) or
+                  (o3 == 0 and _on_segment(cx, cy, dx, dy, ax, ay)) or
+                  (o4 == 0 and _on_segment(cx, cy, dx, dy, bx, by))):
+                yield key
+
+    def crosses(self, ax, ay, bx, by, keys=None, connecting=()):
+        '''Whether any edge has a common point with [a, b] (see crossing)'''
+        for key in self.crossing(ax, ay, bx, by, keys, connecting):
+            return True
+        return False
+
+
+def nearest_pairs(points, others):
+    '''Iterate over the pairs (i, j) of indices of a Point of points and a
+       Point of others, by increasing distance between them
+       Pairs are generated lazily: points are sorted by abscissa, and for
+       each Point of others, the ones on its left and on its right are
+       visited outwards, their abscissa difference bounding their distance
+       from below. Taking only the first few pairs costs little more than
+       the sort.
+
+        >>> points = [Point(0,0), Point(5,0), Point(9,9)]
+        >>> list(nearest_pairs(points, [Point(4,0), Point(1,1)]))[:3]
+        [(1, 0), (0, 1), (0, 0)]
+    '''
+    order = sorted(range(len(points)), key=lambda i: points[i].x)
+    xs = [points[i].x for i in order]
+    ys = [points[i].y for i in order]
+
+    # Exact entries: (squared distance, 0, j, position in order, 0)
+    # Bound entries: (squared abscissa difference, 1, j, position, step),
+    # standing for the points at position, position + step, ...
+    heap = []
+    for j, p in enumerate(others):
+        k = bisect.bisect_left(xs, p.x)
+        if k < len(xs):
+            heap.append(((xs[k] - p.x) ** 2, 1, j, k, 1))
+        if k > 0:
+            heap.append(((xs[k - 1] - p.x) ** 2, 1, j, k - 1, -1))
+    heapq.heapify(heap)
+
+    while heap:
+        d2, bound, j, k, step = heapq.heappop(heap)
+        if not bound:
+            yield order[k], j
+            continue
+        p = others[j]
+        heapq.heappush(heap, ((xs[k] - p.x) ** 2 + (ys[k] - p.y) ** 2,
+                              0, j, k, 0))
+        k += step
+        if 0 <= k < len(xs):
+            heapq.heappush(heap, ((xs[k] - p.x) ** 2, 1, j, k, step))
+
+def self_intersections(points):
+    '''Pairs (i, j), i < j, of edges of a polyline (edge i going from
+       points[i] to points[i + 1]) having common points, other than a shared
+       end, or than being the same edge both ways (a bridge made by
+       inline() and its way back)
+       Edges are swept by increasing abscissa: each one is only tested, all
+       at once by EdgeSet.crossing(), against the active edges, whose
+       abscissa range overlaps its own.
+
+        >>> self_intersections([Point(0,0), Point(2,2), Point(2,0), Point(0,2)])
+        [(0, 2)]
+
+       Collinear edges overlapping each other meet; zero-length edges and
+       a bridge with its way back do not:
+
+        >>> self_intersections([Point(0,0), Point(2,0), Point(1,0), Point(1,1)])
+        [(0, 1), (0, 2)]
+        >>> self_intersections([Point(0,0), Point(1,0), Point(1,0), Point(0,1),
+        ...                     Point(0,0)])
+        []
+        >>> self_intersections([Point(0,0), Point(1,0), Point(0,0)])
+        []
+    '''
+    edges = EdgeSet()
+    for i in range(1, len(points)):
+        edges.add(points[i - 1].x, points[i - 1].y, points[i].x, points[i].y)
+    xs0, ys0, xs1, ys1 = edges.x0, edges.y0, edges.x1, edges.y1
+
+    found = []
+    # Active edges: (end abscissa, key)
+    active = []
+    for k in sorted(range(len(edges)), key=lambda k: min(xs0[k], xs1[k])):
+        ax, ay, bx, by = xs0[k], ys0[k], xs1[k], ys1[k]
+        if ax == bx and ay == by:
+            continue
+        xmin = min(ax, bx)
+        while active and active[0][0] < xmin:
+            heapq.heappop(active)
+        for m in edges.crossing(ax, ay, bx, by, [key for x, key in active]):
+            if not _shared_end(ax, ay, bx, by, xs0[m], ys0[m], xs1[m], ys1[m]):
+                found.append((min(k, m), max(k, m)))
+        heapq.heappush(active, (max(ax, bx), k))
+    return sorted(found)
+
+def _shared_end(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Whether meeting segments [a, b] and [c, d] are the same both ways,
+       or only meet at a common end'''
+    if (ax, ay, bx, by) == (dx, dy, cx, cy):
+        return True
+    for (px, py), (qx, qy) in (((ax, ay), (bx, by)), ((bx, by), (ax, ay))):
+        for (rx, ry), (sx, sy) in (((cx, cy), (dx, dy)), ((dx, dy), (cx, cy))):
+            if (px, py) == (rx, ry):
+                # Unless they go the same way from it
+                return (_orientation(px, py, qx, qy, sx, sy) != 0 or
+                        (qx - px) * (sx - px) + (qy - py) * (sy - py) < 0)
+    return False
+
+def _triangle_area(ax, ay, bx, by, cx, cy):
+    return abs((bx - ax) * (cy - ay) - (by - ay) * (cx - ax)) / 2.0
+
+def _in_triangle(ax, ay, bx, by, cx, cy, px, py):
+    '''Whether p is strictly inside triangle abc'''
+    o1 = _orientation(ax, ay, bx, by, px, py)
+    o2 = _orientation(bx, by, cx, cy, px, py)
+    o3 = _orientation(cx, cy, ax, ay, px, py)
+    return o1 != 0 and o1 == o2 == o3
+
+def simplify_polygon(rings, area=None, max_vertices=None):
+    '''Visvalingam-Whyatt simplification of a polygon given as a list of
+       rings (lists of Points, closed or not): vertices are removed by
+       increasing effective area (the area of the triangle they form with
+       their neighbours), kept on a heap
+       Removal goes on while the smallest area is below area, or while the
+       polygon has more than max_vertices vertices. A vertex is only removed
+       if the edge replacing it does not meet any other edge of any ring, and
+       the triangle cut off contains no other vertex: the rings stay simple
+       and do not cross each other. Each ring keeps at least 3 vertices.
+       Return the simplified rings, closed like the given ones.
+
+       The corner of the square cutting off the hole is kept:
+
+        >>> square = [Point(0,0), Point(10,0), Point(10,10), Point(0,10),
+        ...           Point(0,0)]
+        >>> hole = [Point(1,1), Point(1,2), Point(2,1), Point(1,1)]
+        >>> [[p.coord() for p in ring] for ring in
+        ...  simplify_polygon([square, hole], max_vertices=6)][0]
+        [(0.0, 0.0), (10.0, 0.0), (0.0, 10.0), (0.0, 0.0)]
+    '''
+    # All vertices, numbered across rings, in doubly linked rings
+    points = []
+    prev = []
+    next = []
+    # Per ring: whether it is closed, its first vertex, its vertex count
+    closed = []
+    ring_first = []
+    ring_size = []
+    ring_of = []
+    for ring in rings:
+        ring_points = []
+        for p in ring:
+            if not ring_points or p.coord() != ring_points[-1].coord():
+                ring_points.append(p)
+        closed.append(len(ring_points) > 1 and
+                      ring_points[0].coord() == ring_points[-1].coord())
+        if closed[-1]:
+            ring_points.pop()
+        first = len(points)
+        n = len(ring_points)
+        points.extend(ring_points)
+        prev.extend(first + (i - 1) % n for i in range(n))
+        next.extend(first + (i + 1) % n for i in range(n))
+        ring_of.extend([len(ring_first)] * n)
+        ring_first.append(first)
+        ring_size.append(n)
+
+    if not points:
+        return [list(ring) for ring in rings]
+
+    xs = [p.x for p in points]
+    ys = [p.y for p in points]
+
+    # Edge k goes from vertex k to vertex next[k]
+    grid = SegmentGrid.from_segments((xs[k], ys[k], xs[next[k]], ys[next[k]])
+                                     for k in range(len(points)))
+
+    def effective_area(i):
+        p, n = prev[i], next[i]
+        return _triangle_area(xs[p], ys[p], xs[i], ys[i], xs[n], ys[n])
+
+    areas = [effective_area(i) for i in range(len(points))]
+    heap = [(a, i) for i, a in enumerate(areas)]
+    heapq.heapify(heap)
+
+    removed = [False] * len(points)
+    count = len(points)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue
+        if not ((area is not None and a < area) or
+                (max_vertices is not None and count > max_vertices)):
+            break
+        r = ring_of[i]
+        if ring_size[r] <= 3 or not _can_remove(grid, i, prev, next, xs, ys):
+            continue
+
+        p, n = prev[i], next[i]
+        grid.remove(p)
+        grid.remove(i)
+        grid.insert(p, xs[p], ys[p], xs[n], ys[n])
+        next[p] = n
+        prev[n] = p
+        removed[i] = True
+        ring_size[r] -= 1
+        count -= 1
+
+        # The effective area of a vertex never decreases
+        for j in (p, n):
+            areas[j] = max(effective_area(j), a)
+            heapq.heappush(heap, (areas[j], j))
+
+    result = []
+    for ring, first, is_closed in zip(rings, ring_first, closed):
+        if first == len(points) or ring_of[first] != len(result):
+            # Empty ring
+            result.append(list(ring))
+            continue
+        start = first
+        while removed[start]:
+            start += 1
+        simplified = [points[start]]
+        k = next[start]
+        while k != start:
+            simplified.append(points[k])
+            k = next[k]
+        if is_closed:
+            simplified.append(points[start])
+        result.append(simplified)
+    return result
+
+def _can_remove(grid, i, prev, next, xs, ys):
+    '''Whether replacing edges (prev[i], i) and (i, next[i]) by (prev[i],
+       next[i]) keeps the rings simple and apart
+
+       Cutting the bottom corners of a U would cross its arms:
+
+        >>> u = [(0,0), (3,0), (3,3), (2,3), (2,1), (1,1), (1,3), (0,3)]
+        >>> xs, ys = [x for x, y in u], [y for x, y in u]
+        >>> prev = [(i - 1) % 8 for i in range(8)]
+        >>> next = [(i + 1) % 8 for i in range(8)]
+        >>> grid = SegmentGrid.from_segments(
+        ...     (xs[k], ys[k], xs[next[k]], ys[next[k]]) for k in range(8))
+        >>> [_can_remove(grid, i, prev, next, xs, ys) for i in range(8)]
+        [False, False, True, True, True, True, True, True]
+    '''
+    p, n = prev[i], next[i]
+    ax, ay, bx, by, cx, cy = xs[p], ys[p], xs[i], ys[i], xs[n], ys[n]
+    xmin, xmax = min(ax, bx, cx), max(ax, bx, cx)
+    ymin, ymax = min(ay, by, cy), max(ay, by, cy)
+    # Edges sharing a vertex with the new edge
+    own = (prev[p], p, i, n)
+    segments = grid.segments
+    for key in grid.query(xmin, ymin, xmax, ymax):
+        if key in own:
+            continue
+        x0, y0, x1, y1 = segments[key]
+        # Edges away from the triangle
+        if ((x0 < xmin and x1 < xmin) or (x0 > xmax and x1 > xmax) or
+                (y0 < ymin and y1 < ymin) or (y0 > ymax and y1 > ymax)):
+            continue
+        if segments_intersect(ax, ay, cx, cy, x0, y0, x1, y1):
+            return False
+        if (_in_triangle(ax, ay, bx, by, cx, cy, x0, y0) or
+                _in_triangle(ax, ay, bx, by, cx, cy, x1, y1)):
+            return False
+    return True
+
+def signed_area(ring):
+    '''Signed area of a ring of Points (closed or not): positive when its
+       vertices turn left, i.e. counterclockwise with the y axis up'''
+    return _signed_area([(p.x, p.y) for p in ring])
+
+def _signed_area(points):
+    '''signed_area() of a ring of (x, y) pairs (summed exactly for
+       integers)'''
+    area = 0
+    for i in range(len(points)):
+        (x0, y0), (x1, y1) = points[i - 1], points[i]
+        area += x0 * y1 - x1 * y0
+    return area / 2.0
+
+
+class _Locator(object):
+    '''Point in polygon tests against a set of (x0, y0, x1, y1) edges
+       forming rings: the edges are bucketed in horizontal bands, so that a
+       test only visits the edges at the ordinate of the point. Tests are
+       exact for integer coordinates.'''
+    def __init__(self, edges):
+        self.ymin = min(min(y0, y1) for x0, y0, x1, y1 in edges)
+        self.ymax = max(max(y0, y1) for x0, y0, x1, y1 in edges)
+        count = max(1, int(math.sqrt(len(edges))))
+        height = float(self.ymax - self.ymin) / count
+        self.height = height if height > 0 else 1.0
+        self.bands = [[] for i in range(count)]
+        for edge in edges:
+            x0, y0, x1, y1 = edge
+            for band in range(self._band(min(y0, y1)),
+                              self._band(max(y0, y1)) + 1):
+                self.bands[band].append(edge)
+
+    @classmethod
+    def from_ring(cls, ring):
+        return cls([(ring[i - 1].x, ring[i - 1].y, ring[i].x, ring[i].y)
+                    for i in range(len(ring))])
+
+    def _band(self, y):
+        return min(int((y - self.ymin) / self.height), len(self.bands) - 1)
+
+    def locate(self, x, y, skip=None):
+        '''1 if (x, y) is inside the rings (with the even-odd rule), -1 if
+           it is outside, 0 if it is on an edge
+           The edges equal to skip (either way) are left out: for a point on
+           skip, this tells on which side of skip the point just right of it
+           is.'''
+        if y < self.ymin or y > self.ymax:
+            return -1
+        if skip is not None:
+            back = skip[2:] + skip[:2]
+        inside = False
+        for edge in self.bands[self._band(y)]:
+            if skip is not None and (edge == skip or edge == back):
+                continue
+            x0, y0, x1, y1 = edge
+            cross = (x1 - x0) * (y - y0) - (y1 - y0) * (x - x0)
+            if cross == 0 and _on_segment(x0, y0, x1, y1, x, y):
+                return 0
+            # Edges crossing the horizontal ray going right from (x, y)
+            if (y0 > y) != (y1 > y) and (cross > 0) == (y1 > y0):
+                inside = not inside
+        return 1 if inside else -1
+
+
+def nest_rings(rings):
+    '''Containment tree of rings of Points which do not cross each other,
+       filled with the even-odd rule: the rings nested in an even number of
+       others are outer boundaries, the other ones are holes of the ring
+       directly around them
+       Rings are placed by decreasing absolute area, so that the rings
+       around a ring are placed before it; only the ones whose bounding box
+       contains its own are tested, the innermost first.
+       Return a list of (outer, holes) pairs of indices in rings, in the
+       order of the outer rings.
+
+       An island in the hole of a ring is an outer boundary again:
+
+        >>> def square(x, y, side):
+        ...     return [Point(x, y), Point(x + side, y),
+        ...             Point(x + side, y + side), Point(x, y + side)]
+        >>> nest_rings([square(0, 0, 6), square(1, 1, 4), square(2, 2, 2),
+        ...             square(10, 0, 1)])
+        [(0, [1]), (2, []), (3, [])]
+    '''
+    boxes = []
+    for ring in rings:
+        if ring:
+            xs = [p.x for p in ring]
+            ys = [p.y for p in ring]
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+        else:
+            boxes.append(None)
+    order = sorted(range(len(rings)), key=lambda i: -abs(signed_area(rings[i])))
+
+    locators = {}
+    parent = [None] * len(rings)
+    depth = [0] * len(rings)
+    placed = []
+    for i in order:
+        box = boxes[i]
+        if box is None:
+            continue
+        for j in reversed(placed):
+            other = boxes[j]
+            if not (other[0] <= box[0] and other[1] <= box[1] and
+                    box[2] <= other[2] and box[3] <= other[3]):
+                continue
+            locator = locators.get(j)
+            if locator is None:
+                locator = locators[j] = _Locator.from_ring(rings[j])
+            # The first vertex off the boundary of the other ring tells
+            # on which side of it the ring is
+            for p in rings[i]:
+                side = locator.locate(p.x, p.y)
+                if side:
+                    break
+            if side > 0:
+                parent[i] = j
+                depth[i] = depth[j] + 1
+                break
+        placed.append(i)
+
+    holes = dict((i, []) for i in range(len(rings))
+                 if rings[i] and depth[i] % 2 == 0)
+    for i in range(len(rings)):
+        if rings[i] and depth[i] % 2:
+            holes[parent[i]].append(i)
+    return [(i, holes[i]) for i in sorted(holes)]
+
+
+def _round_div(n, d):
+    '''n / d rounded to the nearest integer, for integers'''
+    if d < 0:
+        n, d = -n, -d
+    return (2 * n + d) // (2 * d)
+
+def _crossing_point(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Crossing point of segments [a, b] and [c, d] with integer
+       coordinates, rounded to integers, if they cross at a single point
+       within both'''
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    if not (o1 and o2 and o3 and o4) or o1 == o2 or o3 == o4:
+        # Apart, or meeting at an end, which is a vertex already
+        return None
+    num = (cx - ax) * (dy - cy) - (cy - ay) * (dx - cx)
+    den = (bx - ax) * (dy - cy) - (by - ay) * (dx - cx)
+    return (ax + _round_div(num * (bx - ax), den),
+            ay + _round_div(num * (by - ay), den))
+
+def _through_pixel(ax, ay, bx, by, px, py):
+    '''Whether [a, b] meets the square of side 1 centered on p (the hot
+       pixel of p), for integer coordinates: its corners are at half
+       integers, so coordinates are doubled'''
+    ax, ay, bx, by, px, py = 2 * ax, 2 * ay, 2 * bx, 2 * by, 2 * px, 2 * py
+    if (max(ax, bx) < px - 1 or min(ax, bx) > px + 1 or
+            max(ay, by) < py - 1 or min(ay, by) > py + 1):
+        return False
+    sides = set(_orientation(ax, ay, bx, by, px + i, py + j)
+                for i in (-1, 1) for j in (-1, 1))
+    return len(sides) > 1 or 0 in sides
+
+def union_polygons(polygons, resolution):
+    '''Union of polygons, each given as a list of rings of Points filled
+       with the even-odd rule
+       Coordinates are rounded to multiples of resolution, and computed on
+       integers. Edges are snap rounded: split at the rounded points where
+       they cross, and at all the vertices and crossing points whose pixel
+       they go through, so that their pieces only meet at their ends. A
+       piece is on the boundary of the union if it is not inside another
+       polygon, and the polygons along it cover one of its sides only (told
+       by the parity of the crossings of a ray leaving its middle). The
+       pieces are linked into rings, turning as far left as possible where
+       several leave a vertex, so that regions touching at a vertex get
+       rings of their own.
+       Return the rings of the union, closed, with its inside on their left:
+       the outer boundaries have a positive signed_area() and the holes a
+       negative one; nest_rings() tells which holes go in which boundary.
+
+        >>> def square(x, y, side=1):
+        ...     return [Point(x, y), Point(x + side, y),
+        ...             Point(x + side, y + side), Point(x, y + side)]
+        >>> def union(*polygons):
+        ...     return [[p.coord() for p in ring[:-1]]
+        ...             for ring in union_polygons(polygons, 0.001)]
+
+       Touching squares merge, coincident ones give a single ring, and
+       squares touching at a corner keep a ring each:
+
+        >>> union([square(0, 0)], [square(1, 0)])
+        [[(0.0, 0.0), (2.0, 0.0), (2.0, 1.0), (0.0, 1.0)]]
+        >>> union([square(0, 0)], [square(0, 0)])
+        [[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]]
+        >>> union([square(0, 0)], [square(1, 1)])
+        [[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)], [(1.0, 1.0), (2.0, 1.0), (2.0, 2.0), (1.0, 2.0)]]
+
+       A hole is turned the other way:
+
+        >>> rings = union_polygons([[square(0, 0, 4), square(1, 1, 2)]], 0.001)
+        >>> [signed_area(ring) for ring in rings]
+        [16.0, -4.0]
+    '''
+    scale = 1.0 / resolution
+    edges = EdgeSet()
+    for index, rings in enumerate(polygons):
+        for ring in rings:
+            points = []
+            for p in ring:
+                point = (int(round(p.x * scale)), int(round(p.y * scale)))
+                if not points or point != points[-1]:
+                    points.append(point)
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            if len(points) < 3:
+                continue
+            for i in range(len(points)):
+                (ax, ay), (bx, by) = points[i - 1], points[i]
+                edges.add(ax, ay, bx, by, index)
+    if not len(edges):
+        return []
+    edges.index()
+    xs0, ys0, xs1, ys1 = edges.x0, edges.y0, edges.x1, edges.y1
+
+    # Hot pixels: the vertices, and the points where edges cross
+    hot = set(zip(xs0, ys0))
+    for k in range(len(edges)):
+        ax, ay, bx, by = xs0[k], ys0[k], xs1[k], ys1[k]
+        for m in edges.crossing(ax, ay, bx, by):
+            if m > k:
+                point = _crossing_point(ax, ay, bx, by,
+                                        xs0[m], ys0[m], xs1[m], ys1[m])
+                if point is not None:
+                    hot.add(point)
+
+    # Hot pixels by grid cell (the ones of the index of the edges)
+    grid = edges.grid
+    size = grid.cell_size
+    pixels = {}
+    for point in hot:
+        x, y = point
+        for i in range(int(math.floor((x - 0.5) / size)),
+                       int(math.floor((x + 0.5) / size)) + 1):
+            for j in range(int(math.floor((y - 0.5) / size)),
+                           int(math.floor((y + 0.5) / size)) + 1):
+                pixels.setdefault((i, j), []).append(point)
+
+    # Pieces of edges between the hot pixels they go through, undirected,
+    # with the number of times each polygon goes along them
+    pieces = {}
+    pieces_of = [[] for rings in polygons]
+    for k in range(len(edges)):
+        ax, ay, bx, by = xs0[k], ys0[k], xs1[k], ys1[k]
+        ux, uy = bx - ax, by - ay
+        xmin, xmax = min(ax, bx) - 0.5, max(ax, bx) + 0.5
+        ymin, ymax = min(ay, by) - 0.5, max(ay, by) + 0.5
+        through = set([(ax, ay), (bx, by)])
+        for cell in grid._column_cells(ax, ay, bx, by):
+            for x, y in pixels.get(cell, ()):
+                if (xmin <= x <= xmax and ymin <= y <= ymax and
+                        _through_pixel(ax, ay, bx, by, x, y)):
+                    through.add((x, y))
+        points = sorted(through,
+                        key=lambda p: (p[0] - ax) * ux + (p[1] - ay) * uy)
+        owner = edges.owners[k]
+        for i in range(1, len(points)):
+            u, v = min(points[i - 1], points[i]), max(points[i - 1], points[i])
+            owners = pieces.get((u, v))
+            if owners is None:
+                owners = pieces[(u, v)] = {}
+            owners[owner] = owners.get(owner, 0) + 1
+            # Doubled, so that the middle of pieces are integers
+            pieces_of[owner].append((2 * u[0], 2 * u[1], 2 * v[0], 2 * v[1]))
+
+    # Polygons by grid cell, and locators against their pieces (swapped:
+    # with x and y exchanged, for rays going up)
+    boxes = [None] * len(polygons)
+    cells = {}
+    for index, owned in enumerate(pieces_of):
+        if not owned:
+            continue
+        box = boxes[index] = (
+            min(min(x0, x1) for x0, y0, x1, y1 in owned) // 2,
+            min(min(y0, y1) for x0, y0, x1, y1 in owned) // 2,
+            max(max(x0, x1) for x0, y0, x1, y1 in owned) // 2,
+            max(max(y0, y1) for x0, y0, x1, y1 in owned) // 2)
+        for i in range(int(math.floor(box[0] / size)),
+                       int(math.floor(box[2] / size)) + 1):
+            for j in range(int(math.floor(box[1] / size)),
+                           int(math.floor(box[3] / size)) + 1):
+                cells.setdefault((i, j), []).append(index)
+    locators = {}
+
+    def locator(index, swapped):
+        if (index, swapped) not in locators:
+            owned = pieces_of[index]
+            if swapped:
+                owned = [(y0, x0, y1, x1) for x0, y0, x1, y1 in owned]
+            locators[(index, swapped)] = _Locator(owned)
+        return locators[(index, swapped)]
+
+    def inside(index, x, y):
+        '''Whether (x, y), doubled, is strictly inside polygon index'''
+        box = boxes[index]
+        if not (2 * box[0] < x < 2 * box[2] and 2 * box[1] < y < 2 * box[3]):
+            return False
+        return locator(index, False).locate(x, y) > 0
+
+    outgoing = {}
+    for (u, v), owners in pieces.items():
+        x, y = u[0] + v[0], u[1] + v[1]
+        cell = (int(math.floor(x / 2.0 / size)),
+                int(math.floor(y / 2.0 / size)))
+        if any(inside(index, x, y) for index in cells.get(cell, ())
+               if index not in owners):
+            continue
+
+        # Whether the side of the piece towards +x (+y for horizontal
+        # pieces) is covered, and the other one: a polygon going along the
+        # piece an odd number of times covers one of them only
+        piece = (2 * u[0], 2 * u[1], 2 * v[0], 2 * v[1])
+        horizontal = u[1] == v[1]
+        ahead = behind = False
+        for index, count in owners.items():
+            if horizontal:
+                side = locator(index, True).locate(
+                    y, x, (piece[1], piece[0], piece[3], piece[2]))
+            else:
+                side = locator(index, False).locate(x, y, piece)
+            covered = side > 0
+            ahead = ahead or covered
+            behind = behind or covered != (count % 2 == 1)
+        if ahead == behind:
+            continue
+
+        # Orient the piece with the covered side on its left: +y is on the
+        # left of a horizontal piece going right, +x on the right of a
+        # piece going up
+        if ahead != (horizontal or v[1] < u[1]):
+            u, v = v, u
+        outgoing.setdefault(u, []).append(v)
+
+    # Link the pieces into rings
+    result = []
+    for start in sorted(outgoing):
+        if start not in outgoing:
+            continue
+        ring = [start]
+        previous, current = start, _take(outgoing, start, 0)
+        while current != start and current in outgoing:
+            ring.append(current)
+            choices = outgoing[current]
+            dx = current[0] - previous[0]
+            dy = current[1] - previous[1]
+            best = max(range(len(choices)), key=lambda i: math.atan2(
+                dx * (choices[i][1] - current[1]) -
+                dy * (choices[i][0] - current[0]),
+                dx * (choices[i][0] - current[0]) +
+                dy * (choices[i][1] - current[1])))
+            previous, current = current, _take(outgoing, current, best)
+        if current != start:
+            # Not closed: the pieces do not bound a region
+            continue
+        # Drop the vertices left in the middle of straight edges by splits
+        n = len(ring)
+        ring = [ring[i] for i in range(n)
+                if _orientation(ring[i - 1][0], ring[i - 1][1],
+                                ring[i][0], ring[i][1],
+                                ring[(i + 1) % n][0], ring[(i + 1) % n][1])]
+        if len(ring) < 3 or not _signed_area(ring):
+            continue
+        ring.append(ring[0])
+        result.append([Point(x * resolution, y * resolution) for x, y in ring])
+    return result
+
+def _take(outgoing, u, i):
+    '''Remove and return the i-th destination of the pieces leaving u'''
+    choices = outgoing[u]
+    v = choices.pop(i)
+    if not choices:
+        del outgoing[u]
+    return v
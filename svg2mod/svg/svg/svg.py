@@ -20,12 +20,12 @@ from __future__ import absolute_import
 import traceback
 import sys
 import os
-import copy
 import re
 import xml.etree.ElementTree as etree
 import itertools
-import operator
 import json
+from array import array
+from collections import OrderedDict
 from .geometry import *
 
 
@@ -49,23 +49,192 @@ unit_convert = {
         '%' :  1 / 100.0   # 1 percent
         }
 
-class Transformable:
+class LRUCache(object):
+    '''Mapping of bounded size, dropping the least recently used entries
+    first, which counts lookup hits and misses'''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # Move to the most recently used end
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+# match any SVG transformation with its parameter (until final parenthese)
+# [^)]*    == anything but a closing parenthese
+# '|'.join == OR-list of SVG transformations
+svg_transforms = ['matrix', 'translate', 'scale', 'rotate', 'skewX', 'skewY']
+transform_re = re.compile('|'.join([x + r'[^)]*\)' for x in svg_transforms]))
+number_cre = re.compile(number_re)
+
+def parse_transform(t):
+    '''Parse a transform attribute into its composed Matrix, and the angle
+    of its last rotation (None without rotation)'''
+    matrix = Matrix()
+    rotation = None
+
+    for t in transform_re.findall(t):
+        op, arg = t.split('(')
+        op = op.strip()
+        # Keep only numbers
+        arg = [float(x) for x in number_cre.findall(arg)]
+
+        if op == 'matrix':
+            matrix *= Matrix(arg)
+
+        if op == 'translate':
+            tx = arg[0]
+            if len(arg) == 1: ty = 0
+            else: ty = arg[1]
+            matrix *= Matrix([1, 0, 0, 1, tx, ty])
+
+        if op == 'scale':
+            sx = arg[0]
+            if len(arg) == 1: sy = sx
+            else: sy = arg[1]
+            matrix *= Matrix([sx, 0, 0, sy, 0, 0])
+
+        if op == 'rotate':
+            rotation = arg[0]
+            cosa = math.cos(math.radians(arg[0]))
+            sina = math.sin(math.radians(arg[0]))
+            if len(arg) != 1:
+                tx, ty = arg[1:3]
+                matrix *= Matrix([1, 0, 0, 1, tx, ty])
+            matrix *= Matrix([cosa, sina, -sina, cosa, 0, 0])
+            if len(arg) != 1:
+                matrix *= Matrix([1, 0, 0, 1, -tx, -ty])
+
+        if op == 'skewX':
+            tana = math.tan(math.radians(arg[0]))
+            matrix *= Matrix([1, 0, tana, 1, 0, 0])
+
+        if op == 'skewY':
+            tana = math.tan(math.radians(arg[0]))
+            matrix *= Matrix([1, tana, 0, 1, 0, 0])
+
+    return matrix, rotation
+
+# Parsed transform attributes: {transform: (Matrix, rotation)}
+# Matrix objects are never modified in place, so they can be shared
+transform_cache = LRUCache(1024)
+
+display_none_re = re.compile(r'(?:^|;)\s*display\s*:\s*none')
+
+def is_hidden(elt):
+    '''Whether an element is not rendered (display:none)'''
+    if elt.get('display') == 'none':
+        return True
+    style = elt.get('style')
+    return style is not None and display_none_re.search(style) is not None
+
+class Transformable(object):
     '''Abstract class for objects that can be geometrically drawn & transformed'''
+    # Attributes computed on first use by _materialize(), see _defer()
+    _lazy_attrs = ()
+    _raw = None
+    _id = None
+    # Bounding box cache, see bbox(), and the geometry version it was
+    # computed at
+    _bbox = None
+    _bbox_version = None
+    # Bumped by _changed() on every transformation of any element: elements
+    # do not know the groups they belong to, so this is what makes the
+    # boxes cached by these groups stale
+    _geometry_version = 0
+
     def __init__(self, elt=None):
         # a 'Transformable' is represented as a list of Transformable items
         self.rotation = 0
         self.items = []
-        self.id = hex(id(self))
-        # Unit transformation matrix on init
-        self.matrix = Matrix()
-        self.viewport = Point(800, 600) # default viewport is 800x600
+        # Unit transformation matrix on init, shared until transformed
+        self.matrix = identity_matrix
+        self.viewport = default_viewport
         if elt is not None:
-            self.id = elt.get('id', self.id)
+            self._id = elt.get('id')
             # Parse transform attibute to update self.matrix
             self.getTransformations(elt)
 
+    @property
+    def id(self):
+        '''The element id, or a unique one made up for elements without'''
+        if self._id is None:
+            return hex(id(self))
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        self._id = value
+
+    def _defer(self, raw):
+        '''Keep the raw attribute(s) of an element: its geometry (the
+        attributes listed in _lazy_attrs) is only built by _parse_geometry()
+        when one of them is first read, and the transformations requested
+        meanwhile are applied at that time'''
+        self._raw = raw
+        self._pending = []
+
+    def _defer_transform(self, matrix):
+        '''Keep a transformation requested before the geometry is built.
+        As in transform(), no matrix means the element's own transformation
+        only, which is the identity composed with it'''
+        if matrix is None:
+            matrix = identity_matrix
+        self._pending.append(matrix)
+
+    def __getattr__(self, name):
+        # Only called for attributes not (yet) set
+        if self._raw is not None and name in self._lazy_attrs:
+            self._materialize()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _materialize(self):
+        raw, self._raw = self._raw, None
+        self._parse_geometry(raw)
+        pending, self._pending = self._pending, None
+        # The pending transformations were counted when they were requested
+        version = Transformable._geometry_version
+        for matrix in pending:
+            self.transform(matrix)
+        Transformable._geometry_version = version
+
+    @staticmethod
+    def _changed():
+        '''Invalidate the cached bounding boxes of all elements'''
+        Transformable._geometry_version += 1
+
     def bbox(self):
-        '''Bounding box'''
+        '''Bounding box, computed once and kept until an element (this one,
+        one of its descendants or any other) is transformed, scaled,
+        translated or rotated'''
+        if self._bbox_version != Transformable._geometry_version:
+            self._bbox = self._compute_bbox()
+            self._bbox_version = Transformable._geometry_version
+        return self._bbox
+
+    def _compute_bbox(self):
         bboxes = [x.bbox() for x in self.items]
         if len( bboxes ) < 1:
             return (Point(0, 0), Point(0, 0))
@@ -81,61 +250,34 @@ class Transformable:
         t = elt.get('transform')
         if t is None: return
 
-        svg_transforms = [
-                'matrix', 'translate', 'scale', 'rotate', 'skewX', 'skewY']
-
-        # match any SVG transformation with its parameter (until final parenthese)
-        # [^)]*    == anything but a closing parenthese
-        # '|'.join == OR-list of SVG transformations
-        transforms = re.findall(
-                '|'.join([x + '[^)]*\)' for x in svg_transforms]), t)
-
-        for t in transforms:
-            op, arg = t.split('(')
-            op = op.strip()
-            # Keep only numbers
-            arg = [float(x) for x in re.findall(number_re, arg)]
-            print('transform: ' + op + ' '+ str(arg))
-
-            if op == 'matrix':
-                self.matrix *= Matrix(arg)
-
-            if op == 'translate':
-                tx = arg[0]
-                if len(arg) == 1: ty = 0
-                else: ty = arg[1]
-                self.matrix *= Matrix([1, 0, 0, 1, tx, ty])
-
-            if op == 'scale':
-                sx = arg[0]
-                if len(arg) == 1: sy = sx
-                else: sy = arg[1]
-                self.matrix *= Matrix([sx, 0, 0, sy, 0, 0])
-
-            if op == 'rotate':
-                self.rotation = arg[0]
-                cosa = math.cos(math.radians(arg[0]))
-                sina = math.sin(math.radians(arg[0]))
-                if len(arg) != 1:
-                    tx, ty = arg[1:3]
-                    self.matrix *= Matrix([1, 0, 0, 1, tx, ty])
-                self.matrix *= Matrix([cosa, sina, -sina, cosa, 0, 0])
-                if len(arg) != 1:
-                    self.matrix *= Matrix([1, 0, 0, 1, -tx, -ty])
-
-            if op == 'skewX':
-                tana = math.tan(math.radians(arg[0]))
-                self.matrix *= Matrix([1, 0, tana, 1, 0, 0])
-
-            if op == 'skewY':
-                tana = math.tan(math.radians(arg[0]))
-                self.matrix *= Matrix([1, tana, 0, 1, 0, 0])
+        # The same few transform strings come back again and again
+        parsed = transform_cache.get(t)
+        if parsed is None:
+            parsed = parse_transform(t)
+            transform_cache[t] = parsed
+
+        matrix, rotation = parsed
+        self.matrix *= matrix
+        if rotation is not None:
+            self.rotation = rotation
 
     def transform(self, matrix=None):
+        '''Transform the geometry by matrix composed with the element's own
+        transformation, or by the latter only if no matrix is given.
+        Before the geometry is built, this is deferred until then:
+        >>> p = Path(etree.Element('path', d='M0 0L1 1', transform='translate(2)'))
+        >>> p.transform()
+        >>> p.items[1].end
+        (3.000,1.000)
+        '''
+        self._changed()
+        if self._raw is not None:
+            self._defer_transform(matrix)
+            return
         if matrix is None:
             matrix = self.matrix
         else:
-            matrix *= self.matrix
+            matrix = matrix * self.matrix
         #print( "do transform: {}: {}".format( self.__class__.__name__, matrix ) )
         #print( "do transform: {}: {}".format( self, matrix ) )
         #traceback.print_stack()
@@ -172,31 +314,75 @@ class Transformable:
     def ylength(self, y):
         return self.length(y, 'y')
 
+    def walk(self, predicate=None, matrix=None, style=None, layer=None,
+             inherit=None):
+        '''Iterate depth-first, in document order, over the elements below
+        this one, without copying them.
+        Yield (element, matrix, style, layer) for each element which is not
+        a Group or, if predicate is given, for each element matching it
+        (a class or a function of the element); the elements below a
+        matching Group are not visited.
+        matrix is the transformation of the element composed with the ones
+        of the elements above it (and with the given matrix), style what it
+        inherits from the groups above it, inherit(group, style) giving
+        what the children of a group inherit (the group style attribute if
+        it has one by default), and layer the name of the outermost
+        labelled group above it (unless given).'''
+        if predicate is None:
+            match = lambda item: not isinstance(item, Group)
+        elif isinstance(predicate, (type, tuple)):
+            match = lambda item: isinstance(item, predicate)
+        else:
+            match = predicate
+        if inherit is None:
+            inherit = lambda group, style: group.style or style
+
+        if matrix is None:
+            matrix = self.matrix
+        elif self.matrix is not identity_matrix:
+            matrix = matrix * self.matrix
+        if isinstance(self, Group):
+            style = inherit(self, style)
+            layer = layer or self.name or None
+
+        # Per group being visited: its remaining items, and what they inherit
+        stack = [(iter(self.items), matrix, style, layer)]
+        while stack:
+            items, matrix, style, layer = stack[-1]
+            for item in items:
+                if item.matrix is not identity_matrix:
+                    item_matrix = matrix * item.matrix
+                else:
+                    item_matrix = matrix
+                if match(item):
+                    yield (item, item_matrix, style, layer)
+                elif isinstance(item, Group):
+                    stack.append((iter(item.items), item_matrix,
+                                  inherit(item, style),
+                                  layer or item.name or None))
+                    break
+            else:
+                stack.pop()
+
     def flatten(self):
         '''Flatten the SVG objects nested list into a flat (1-D) list,
-        removing Groups'''
-        # http://rightfootin.blogspot.fr/2006/09/more-on-python-flatten.html
-        # Assigning a slice a[i:i+1] with a list actually replaces the a[i]
-        # element with the content of the assigned list
-        i = 0
-        flat = copy.deepcopy(self.items)
-        while i < len(flat):
-            while isinstance(flat[i], Group):
-                flat[i:i+1] = flat[i].items
-            i += 1
-        return flat
+        removing Groups. The elements are not copied.'''
+        return [item for item, matrix, style, layer in self.walk()]
 
     def scale(self, ratio):
+        self._changed()
         for x in self.items:
             x.scale(ratio)
         return self
 
     def translate(self, offset):
+        self._changed()
         for x in self.items:
             x.translate(offset)
         return self
 
     def rotate(self, angle):
+        self._changed()
         for x in self.items:
             x.rotate(angle)
         return self
@@ -206,17 +392,28 @@ class Svg(Transformable):
     # class Svg handles the <svg> tag
     # tag = 'svg'
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, layers=None):
         Transformable.__init__(self)
         if filename:
-            self.parse(filename)
+            self.parse(filename, layers)
 
-    def parse(self, filename):
+    def parse(self, filename, layers=None):
+        '''Parse an SVG file.
+        If layers is given, only the groups labelled with one of these names
+        (and their content) are built, see _iterparse()'''
         self.filename = filename
-        tree = etree.parse(filename)
-        self.root = tree.getroot()
+        if layers is not None:
+            self._iterparse(filename, set(layers))
+        else:
+            tree = etree.parse(filename)
+            self.root = tree.getroot()
+            top_group = self._top_group()
+            # Parse XML elements hierarchically with groups <g>
+            top_group.append(self.root, self.matrix * top_group.matrix)
+
+    def _top_group(self):
         if self.root.tag != svg_ns + 'svg':
-            raise TypeError('file %s does not seem to be a valid SVG file', filename)
+            raise TypeError('file %s does not seem to be a valid SVG file', self.filename)
 
         # Create a top Group to group all other items (useful for viewBox elt)
         top_group = Group()
@@ -237,10 +434,65 @@ class Svg(Transformable):
             ty = -float(viewBox[1])
             top_group.matrix = Matrix([sx, 0, 0, sy, tx, ty])
 
-        # Parse XML elements hierarchically with groups <g>
-        top_group.append(self.root)
+        return top_group
+
+    def _iterparse(self, filename, layers):
+        '''Streaming parser: only groups labelled with a name in layers get
+        their drawing elements built. Other groups are kept (empty) only if
+        they lead to such a layer, hidden subtrees and non-group elements
+        (defs, metadata, clip paths...) are skipped, and every element is
+        cleared and removed from its parent once handled, so that memory use
+        follows the exported content rather than the file size.
+        As in Group.append(), transformations are composed once per group.'''
+        # One (Group or None, inside a wanted layer, group matrix, element)
+        # entry per open element; None means the element and its children
+        # are skipped
+        stack = []
+
+        for event, elt in etree.iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                if not stack:
+                    self.root = elt
+                    top_group = self._top_group()
+                    stack.append((top_group, False,
+                                  self.matrix * top_group.matrix, elt))
+                    continue
+
+                group, wanted, matrix = stack[-1][:3]
+                item = None
+                if group is not None and not is_hidden(elt):
+                    if elt.tag == svg_ns + 'g':
+                        item = Group(elt)
+                        wanted = wanted or item.name in layers
+                    elif wanted:
+                        elt_class = svgClass.get(elt.tag, None)
+                        if elt_class is None:
+                            print('No handler for element %s' % elt.tag)
+                        else:
+                            item = elt_class(elt)
+
+                if item is not None:
+                    item.viewport = group.viewport
+                    group.items.append(item)
+                    if isinstance(item, Group):
+                        matrix = matrix * item.matrix
+                    else:
+                        item.transform(matrix)
+                        item = None
+                stack.append((item, wanted, matrix, elt))
 
-        self.transform()
+            else:
+                group, wanted, matrix, elt = stack.pop()
+                if not stack:
+                    break
+                # Drop groups which did not lead to any wanted layer
+                # (such a group is always the last item of its parent)
+                if group is not None and not wanted and not group.items:
+                    stack[-1][0].items.pop()
+                # The children handled before were removed: this one is the
+                # first left
+                elt.clear()
+                stack[-1][3].remove(elt)
 
     def title(self):
         t = self.root.find(svg_ns + 'title')
@@ -262,9 +514,11 @@ class Group(Transformable):
         Transformable.__init__(self, elt)
         
         self.name = ""
+        self.style = None
         if elt is not None:
+            self.style = elt.get('style')
             
-            for id, value in elt.attrib.iteritems():
+            for id, value in elt.attrib.items():
 
                 id = self.parse_name( id )
                 if id[ "name" ] == "label":
@@ -278,25 +532,31 @@ class Group(Transformable):
             'name' : m.group( 3 ),
         }
 
-    def append(self, element):
+    def append(self, element, matrix=None):
+        '''Build the children of element into this group.
+        matrix is the transformation of the group, composed with the ones
+        of its ancestors: it is handed down once per group, and applied
+        to the other elements when their geometry is built.
+        Hidden subtrees are skipped, as in Svg._iterparse()'''
+        if matrix is None:
+            matrix = self.matrix
         for elt in element:
+            if is_hidden(elt):
+                continue
             elt_class = svgClass.get(elt.tag, None)
             if elt_class is None:
                 print('No handler for element %s' % elt.tag)
                 continue
             # instanciate elt associated class (e.g. <path>: item = Path(elt)
             item = elt_class(elt)
-            # Apply group matrix to the newly created object
-            # Actually, this is effectively done in Svg.__init__() through call to
-            # self.transform(), so doing it here will result in the transformations
-            # being applied twice.
-            #item.matrix = self.matrix * item.matrix
             item.viewport = self.viewport
 
             self.items.append(item)
             # Recursively append if elt is a <g> (group)
             if elt.tag == svg_ns + 'g':
-                item.append(elt)
+                item.append(elt, matrix * item.matrix)
+            else:
+                item.transform(matrix)
 
     def __repr__(self):
         return '<Group ' + self.id + " ({})".format( self.name ) + '>: ' + repr(self.items)
@@ -304,14 +564,16 @@ class Group(Transformable):
     def json(self):
         return {'Group ' + self.id + " ({})".format( self.name ) : self.items}
 
-class Matrix:
+class Matrix(object):
     ''' SVG transformation matrix and its operations
     a SVG matrix is represented as a list of 6 values [a, b, c, d, e, f]
     (named vect hereafter) which represent the 3x3 matrix
     ((a, c, e)
      (b, d, f)
      (0, 0, 1))
-    see http://www.w3.org/TR/SVG/coords.html#EstablishingANewUserSpace '''
+    see http://www.w3.org/TR/SVG/coords.html#EstablishingANewUserSpace
+    Matrices are never modified in place: operations return new ones'''
+    __slots__ = ('vect',)
 
     def __init__(self, vect=[1, 0, 0, 1, 0, 0]):
         # Unit transformation vect by default
@@ -321,6 +583,11 @@ class Matrix:
 
     def __mul__(self, other):
         '''Matrix multiplication'''
+        if other.__class__ is Point:
+            a, b, c, d, e, f = self.vect
+            return Point(other.x * a + other.y * c + e,
+                         other.x * b + other.y * d + f)
+
         if isinstance(other, Matrix):
             a = self.vect[0] * other.vect[0] + self.vect[2] * other.vect[1]
             b = self.vect[1] * other.vect[0] + self.vect[3] * other.vect[1]
@@ -348,157 +615,204 @@ class Matrix:
     def ylength(self, y):
         return y * self.vect[3]
 
+# Shared by all elements until they are transformed
+identity_matrix = Matrix()
+default_viewport = Point(800, 600) # default viewport is 800x600
+
 
 COMMANDS = 'MmZzLlHhVvCcSsQqTtAa'
 
+# Number of arguments of each path command
+path_arity = {'M': 2, 'Z': 0, 'L': 2, 'H': 1, 'V': 1,
+              'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7}
+
+# A command letter followed by its (possibly repeated) arguments
+path_command_re = re.compile(r'([%s])([^%s]*)' % (COMMANDS, COMMANDS))
+# Arc flags are single digits, which need not be separated from what follows
+arc_args_re = re.compile(r'[\s,]*'.join([r'']
+        + ['(%s)' % number_re] * 3 + ['([01])'] * 2 + ['(%s)' % number_re] * 2))
+
+def tokenize_path(pathstr):
+    '''Split SVG path data into (command, arguments) pairs, one per drawn
+    element: implicitly repeated commands are expanded (extra MoveTo
+    coordinates becoming LineTo), and the numbers following a command letter
+    are converted at once into an array of floats
+    >>> [(c, list(v)) for c, v in tokenize_path('M1,2 3-4z')]
+    [('M', [1.0, 2.0]), ('L', [3.0, -4.0]), ('z', [])]
+    '''
+    start = pathstr.lstrip()[:1]
+    if start and start not in COMMANDS:
+        raise ValueError("No command found at %d" % 0)
+
+    for command, argstr in path_command_re.findall(pathstr):
+        if command in 'Aa':
+            values = array('d')
+            m = arc_args_re.match(argstr)
+            while m is not None:
+                values.extend(map(float, m.groups()))
+                m = arc_args_re.match(argstr, m.end())
+        else:
+            values = array('d', map(float, number_cre.findall(argstr)))
+
+        n = path_arity[command.upper()]
+        if n == 0:
+            yield command, values
+            continue
+
+        for i in range(0, len(values) - n + 1, n):
+            yield command, values[i:i+n]
+            # MoveTo with multiple coordinates means LineTo
+            if command == 'M': command = 'L'
+            elif command == 'm': command = 'l'
+
 class Path(Transformable):
     '''SVG <path>'''
     # class Path handles the <path> tag
     tag = 'path'
+    _lazy_attrs = ('items',)
 
     def __init__(self, elt=None):
         Transformable.__init__(self, elt)
         if elt is not None:
             self.style = elt.get('style')
-            self.parse(elt.get('d'))
-
-    def parse(self, pathstr):
-        """Parse path string and build elements list"""
+            # Path data is parsed on first access to items
+            del self.items
+            self._defer(elt.get('d'))
 
-        pathlst = re.findall(number_re + r"|\ *[%s]\ *" % COMMANDS, pathstr)
-
-        pathlst.reverse()
+    def _parse_geometry(self, pathstr):
+        self.items = []
+        # The first pending transformation is applied while parsing
+        matrix = None
+        if self._pending:
+            matrix = self._pending.pop(0) * self.matrix
+        self.parse(pathstr, matrix)
+
+    def parse(self, pathstr, matrix=None):
+        """Parse path string and build elements list
+        If matrix is given, the points are transformed as they are built
+        Closing a subpath moves the current point back to its start:
+        >>> p = Path()
+        >>> p.parse('m0 0 l1 1 z m5 5 l1 0')
+        >>> p.items[3].dest
+        (5.000,5.000)
+        """
 
-        command = None
-        current_pt = Point(0,0)
+        if matrix is None:
+            point = Point
+        else:
+            a, b, c, d, e, f = matrix.vect
+            def point(x, y):
+                return Point(x * a + y * c + e, x * b + y * d + f)
+
+        last_command = None
+        # Current, subpath start and last control points, in path coordinates
+        cx = cy = 0.0
+        sx = sy = 0.0
+        ctrl = None
+        # and the Points built for the current and subpath start points
+        current_pt = point(0.0, 0.0)
         start_pt = None
 
-        while pathlst:
-            if pathlst[-1].strip() in COMMANDS:
+        for command, args in tokenize_path(pathstr):
+            absolute = (command == command.upper())
+            command = command.upper()
+
+            if command == 'Z':
+            # Close Path
+                l = Segment(current_pt, start_pt)
+                self.items.append(l)
+                cx, cy = sx, sy
+                current_pt = start_pt
                 last_command = command
-                command = pathlst.pop().strip()
-                absolute = (command == command.upper())
-                command = command.upper()
+                continue
+
+            # Relative coordinates are offset by the current point
+            if absolute:
+                ox = oy = None
             else:
-                if command is None:
-                    raise ValueError("No command found at %d" % len(pathlst))
+                ox, oy = cx, cy
 
             if command == 'M':
             # MoveTo
-                x = pathlst.pop()
-                y = pathlst.pop()
-                pt = Point(x, y)
-                if absolute:
-                    current_pt = pt
-                else:
-                    current_pt += pt
-                start_pt = current_pt
+                x, y = args
+                if ox is not None:
+                    x += ox
+                    y += oy
+                cx, cy = sx, sy = x, y
+                current_pt = start_pt = point(x, y)
 
                 self.items.append(MoveTo(current_pt))
 
-                # MoveTo with multiple coordinates means LineTo
-                command = 'L'
-
-            elif command == 'Z':
-            # Close Path
-                l = Segment(current_pt, start_pt)
-                self.items.append(l)
-
-
             elif command in 'LHV':
             # LineTo, Horizontal & Vertical line
                 # extra coord for H,V
-                if absolute:
-                    x,y = current_pt.coord()
+                if command == 'L':
+                    x, y = args
+                elif command == 'H':
+                    x, y = args[0], (0 if ox is not None else cy)
                 else:
-                    x,y = (0,0)
-
-                if command in 'LH':
-                    x = pathlst.pop()
-                if command in 'LV':
-                    y = pathlst.pop()
+                    x, y = (0 if ox is not None else cx), args[0]
 
-                pt = Point(x, y)
-                if not absolute:
-                    pt += current_pt
+                if ox is not None:
+                    x += ox
+                    y += oy
+                pt = point(x, y)
 
                 self.items.append(Segment(current_pt, pt))
+                cx, cy = x, y
                 current_pt = pt
 
-            elif command in 'CQ':
-                dimension = {'Q':3, 'C':4}
-                bezier_pts = []
-                bezier_pts.append(current_pt)
-                for i in range(1,dimension[command]):
-                    x = pathlst.pop()
-                    y = pathlst.pop()
-                    pt = Point(x, y)
-                    if not absolute:
-                        pt += current_pt
-                    bezier_pts.append(pt)
-
+            elif command in 'CQTS':
+                coords = [(cx, cy)]
+
+                if command in 'TS':
+                    # last command control
+                    last = {'T': 'QT', 'S':'CS'}
+
+                    if last_command in last[command]:
+                        x0, y0 = ctrl
+                    else:
+                        x0, y0 = cx, cy
+                    # Symetrical of the current point against the last
+                    # control point of the previous Bezier
+                    coords.append((cx + cx - x0, cy + cy - y0))
+
+                for i in range(0, len(args), 2):
+                    x, y = args[i], args[i+1]
+                    if ox is not None:
+                        x += ox
+                        y += oy
+                    coords.append((x, y))
+
+                bezier_pts = [current_pt]
+                bezier_pts.extend(point(x, y) for x, y in coords[1:])
                 self.items.append(Bezier(bezier_pts))
-                current_pt = pt
-
-            elif command in 'TS':
-                # number of points to read
-                nbpts = {'T':1, 'S':2}
-                # the control point, from previous Bezier to mirror
-                ctrlpt = {'T':1, 'S':2}
-                # last command control
-                last = {'T': 'QT', 'S':'CS'}
-
-                bezier_pts = []
-                bezier_pts.append(current_pt)
-
-                if last_command in last[command]:
-                    pt0 = self.items[-1].control_point(ctrlpt[command])
-                else:
-                    pt0 = current_pt
-                pt1 = current_pt
-                # Symetrical of pt1 against pt0
-                bezier_pts.append(pt1 + pt1 - pt0)
-
-                for i in range(0,nbpts[command]):
-                    x = pathlst.pop()
-                    y = pathlst.pop()
-                    pt = Point(x, y)
-                    if not absolute:
-                        pt += current_pt
-                    bezier_pts.append(pt)
-
-                self.items.append(Bezier(bezier_pts))
-                current_pt = pt
+                ctrl = coords[-2]
+                cx, cy = coords[-1]
+                current_pt = bezier_pts[-1]
 
             elif command == 'A':
-                rx = pathlst.pop()
-                ry = pathlst.pop()
-                xrot = pathlst.pop()
-                # Arc flags are not necesarily sepatated numbers
-                flags = pathlst.pop().strip()
-                large_arc_flag = flags[0]
-                if large_arc_flag not in '01':
-                    print('Arc parsing failure')
-                    break
-
-                if len(flags) > 1:  flags = flags[1:].strip()
-                else:               flags = pathlst.pop().strip()
-                sweep_flag = flags[0]
-                if sweep_flag not in '01':
-                    print('Arc parsing failure')
-                    break
-
-                if len(flags) > 1:  x = flags[1:]
-                else:               x = pathlst.pop()
-                y = pathlst.pop()
-                # TODO
-                print('ARC: ' +
-                    ', '.join([rx, ry, xrot, large_arc_flag, sweep_flag, x, y]))
-#                self.items.append(
-#                    Arc(rx, ry, xrot, large_arc_flag, sweep_flag, Point(x, y)))
+                rx, ry, xrot, large_arc_flag, sweep_flag, x, y = args
+                if ox is not None:
+                    x += ox
+                    y += oy
+                pt = point(x, y)
+
+                if rx == 0 or ry == 0:
+                    # Null radius arcs are straight lines
+                    self.items.append(Segment(current_pt, pt))
+                elif (x, y) != (cx, cy):
+                    # Arcs are built untransformed, then transformed as a
+                    # whole (their axes too)
+                    arc = Arc(Point(cx, cy), rx, ry, xrot,
+                              large_arc_flag, sweep_flag, Point(x, y))
+                    if matrix is not None:
+                        arc.transform(matrix)
+                    self.items.append(arc)
+                cx, cy = x, y
+                current_pt = pt
 
-            else:
-                pathlst.pop()
+            last_command = command
 
     def __str__(self):
         return '\n'.join(str(x) for x in self.items)
@@ -506,9 +820,10 @@ class Path(Transformable):
     def __repr__(self):
         return '<Path ' + self.id + '>'
 
-    def segments(self, precision=0):
+    def segments(self, precision=0, tolerance=None):
         '''Return a list of segments, each segment is ended by a MoveTo.
-           A segment is a list of Points'''
+           A segment is a list of Points
+           Curves are flattened adaptively if a tolerance is given'''
         ret = []
         # group items separated by MoveTo
         for moveTo, group in itertools.groupby(self.items,
@@ -516,12 +831,21 @@ class Path(Transformable):
             # Use only non MoveTo item
             if not moveTo:
                 # Generate segments for each relevant item
-                seg = [x.segments(precision) for x in group]
+                seg = [x.segments(precision, tolerance) for x in group]
                 # Merge all segments into one
                 ret.append(list(itertools.chain.from_iterable(seg)))
 
         return ret
 
+    def shape_key(self, quantum):
+        '''The first point of the path, and a key which is the same for the
+           paths which are translated copies of this one (to within quantum),
+           or (None, None) for a path which does not start with a MoveTo'''
+        if not self.items or not isinstance(self.items[0], MoveTo):
+            return None, None
+        origin = self.items[0].dest
+        return origin, tuple(x.shape_key(origin, quantum) for x in self.items)
+
     def simplify(self, precision):
         '''Simplify segment with precision:
            Remove any point which are ~aligned'''
@@ -535,16 +859,20 @@ class Ellipse(Transformable):
     '''SVG <ellipse>'''
     # class Ellipse handles the <ellipse> tag
     tag = 'ellipse'
+    _lazy_attrs = ('center', 'rx', 'ry')
 
     def __init__(self, elt=None):
         Transformable.__init__(self, elt)
         if elt is not None:
-            self.center = Point(self.xlength(elt.get('cx')),
-                                self.ylength(elt.get('cy')))
-            self.rx = self.length(elt.get('rx'))
-            self.ry = self.length(elt.get('ry'))
+            self._defer([elt.get(x) for x in ('cx', 'cy', 'rx', 'ry')])
             self.style = elt.get('style')
 
+    def _parse_geometry(self, attrs):
+        cx, cy, rx, ry = attrs
+        self.center = Point(self.xlength(cx), self.ylength(cy))
+        self.rx = self.length(rx)
+        self.ry = self.length(ry)
+
     def __repr__(self):
         return '<Ellipse ' + self.id + '>'
 
@@ -554,18 +882,25 @@ class Ellipse(Transformable):
         pmax = self.center + Point(self.rx, self.ry)
         return (pmin, pmax)
 
-    def transform(self, matrix):
+    def transform(self, matrix=None):
+        self._changed()
+        if self._raw is not None:
+            self._defer_transform(matrix)
+            return
         self.center = self.matrix * self.center
         self.rx = self.matrix.xlength(self.rx)
         self.ry = self.matrix.ylength(self.ry)
 
     def scale(self, ratio):
+        self._changed()
         self.center *= ratio
         self.rx *= ratio
         self.ry *= ratio
     def translate(self, offset):
+        self._changed()
         self.center += offset
     def rotate(self, angle):
+        self._changed()
         self.center = self.center.rot(angle)
 
     def P(self, t):
@@ -574,21 +909,21 @@ class Ellipse(Transformable):
         y = self.center.y + self.ry * math.sin(2 * math.pi * t)
         return Point(x,y)
 
-    def segments(self, precision=0):
-        if max(self.rx, self.ry) < precision:
+    def segments(self, precision=0, tolerance=None):
+        '''Return the Ellipse as a closed polygon, with as few chords as
+           keep the distance to the ellipse (sagitta) below precision'''
+        if tolerance is not None:
+            precision = tolerance
+        r = max(self.rx, self.ry)
+        if r < precision:
             return [[self.center]]
 
-        p = [(0,self.P(0)), (1, self.P(1))]
-        d = 2 * max(self.rx, self.ry)
-
-        while d > precision:
-            for (t1,p1),(t2,p2) in zip(p[:-1],p[1:]):
-                t = t1 + (t2 - t1)/2.
-                d = Segment(p1, p2).pdistance(self.P(t))
-                p.append((t, self.P(t)))
-            p.sort(key=operator.itemgetter(0))
-
-        ret = [x for t,x in p]
+        n = chord_count(2 * math.pi, r, precision)
+        cx, cy = self.center.coord()
+        rx, ry = self.rx, self.ry
+        ret = [Point(cx + rx * cos, cy + ry * sin)
+               for cos, sin in unit_circle(n)]
+        ret.append(Point(ret[0].x, ret[0].y))
         return [ret]
 
     def simplify(self, precision):
@@ -613,16 +948,20 @@ class Rect(Transformable):
     '''SVG <rect>'''
     # class Rect handles the <rect> tag
     tag = 'rect'
+    _lazy_attrs = ('P1', 'P2')
 
     def __init__(self, elt=None):
         Transformable.__init__(self, elt)
         if elt is not None:
             self.type = elt.get('type')
-            self.P1 = Point(self.xlength(elt.get('x')),
-                            self.ylength(elt.get('y')))
+            self._defer([elt.get(x) for x in ('x', 'y', 'width', 'height')])
+
+    def _parse_geometry(self, attrs):
+        x, y, width, height = attrs
+        self.P1 = Point(self.xlength(x), self.ylength(y))
 
-            self.P2 = Point(self.P1.x + self.xlength(elt.get('width')),
-                            self.P1.y + self.ylength(elt.get('height')))
+        self.P2 = Point(self.P1.x + self.xlength(width),
+                        self.P1.y + self.ylength(height))
 
     def __repr__(self):
         return '<Rect ' + self.id + '>'
@@ -636,11 +975,15 @@ class Rect(Transformable):
 
         return (Point(xmin,ymin), Point(xmax,ymax))
 
-    def transform(self, matrix):
+    def transform(self, matrix=None):
+        self._changed()
+        if self._raw is not None:
+            self._defer_transform(matrix)
+            return
         self.P1 = self.matrix * self.P1
         self.P2 = self.matrix * self.P2
 
-    def segments(self, precision=0):
+    def segments(self, precision=0, tolerance=None):
         # A rectangle is built with a segment going thru 4 points
         ret = []
         Pa = Point(self.P1.x, self.P2.y)
@@ -656,15 +999,18 @@ class Line(Transformable):
     '''SVG <line>'''
     # class Line handles the <line> tag
     tag = 'line'
+    _lazy_attrs = ('P1', 'P2', 'segment')
 
     def __init__(self, elt=None):
         Transformable.__init__(self, elt)
         if elt is not None:
-            self.P1 = Point(self.xlength(elt.get('x1')),
-                            self.ylength(elt.get('y1')))
-            self.P2 = Point(self.xlength(elt.get('x2')),
-                            self.ylength(elt.get('y2')))
-            self.segment = Segment(self.P1, self.P2)
+            self._defer([elt.get(x) for x in ('x1', 'y1', 'x2', 'y2')])
+
+    def _parse_geometry(self, attrs):
+        x1, y1, x2, y2 = attrs
+        self.P1 = Point(self.xlength(x1), self.ylength(y1))
+        self.P2 = Point(self.xlength(x2), self.ylength(y2))
+        self.segment = Segment(self.P1, self.P2)
 
     def __repr__(self):
         return '<Line ' + self.id + '>'
@@ -678,12 +1024,16 @@ class Line(Transformable):
 
         return (Point(xmin,ymin), Point(xmax,ymax))
 
-    def transform(self, matrix):
+    def transform(self, matrix=None):
+        self._changed()
+        if self._raw is not None:
+            self._defer_transform(matrix)
+            return
         self.P1 = self.matrix * self.P1
         self.P2 = self.matrix * self.P2
         self.segment = Segment(self.P1, self.P2)
 
-    def segments(self, precision=0):
+    def segments(self, precision=0, tolerance=None):
         return [self.segment.segments()]
 
     def simplify(self, precision):
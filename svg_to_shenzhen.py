@@ -3,6 +3,7 @@
 from __future__ import absolute_import
 
 import argparse
+import collections
 import datetime
 import os
 from pprint import pformat, pprint
@@ -14,6 +15,18 @@ import sys
 #----------------------------------------------------------------------------
 DEFAULT_DPI = 96 # 96 as of Inkscape 0.92
 
+# Resolved style of a drawing element (stroke width in mm):
+Style = collections.namedtuple( "Style", [ "fill", "stroke", "stroke_width" ] )
+
+# A shape drawn more than once: its polygons (points relative to the first
+# anchor, fill, stroke, stroke width) and the anchors of its copies:
+Instance = collections.namedtuple( "Instance", [ "layer", "polygons", "anchors" ] )
+
+# The same few style attributes are shared by most elements, so they are only
+# parsed once (the caches are bounded, as they outlive a conversion):
+_inherited_style_cache = svg.LRUCache( 1024 )
+_style_cache = svg.LRUCache( 1024 )
+
 
 #!/usr/bin/python
 
@@ -147,11 +160,17 @@ def main():
 								#" pretty output format"
 						#)
 
-		# Import the SVG:
+		if args.coord_precision < 0:
+				print( "Error: coordinate precision must not be negative" )
+				sys.exit( -1 )
+
+		# Import the SVG.  Only the layers known to the exporter (and the drill
+		# holes) are loaded:
 		imported = Svg2ModImport(
 				args.input_file_name,
 				args.module_name,
-				args.module_value
+				args.module_value,
+				list( Svg2ModExportPretty.layer_map.keys() ) + [ "Drill" ],
 		)
 
 		# Pick an output file name if none was provided:
@@ -177,6 +196,16 @@ def main():
 						args.scale_factor,
 						args.precision,
 						args.dpi,
+						flatten = args.flatten,
+						tolerance = args.tolerance,
+						simplify = args.simplify,
+						vw_area = args.vw_area,
+						max_vertices = args.max_vertices,
+						merge_layers = args.merge_layers,
+						validate = args.validate,
+						nm_grid = args.nm_grid,
+						coord_precision = args.coord_precision,
+						instance_shapes = args.instance_shapes,
 				)
 
 		# Export the footprint:
@@ -185,116 +214,49 @@ def main():
 
 #----------------------------------------------------------------------------
 
-class LineSegment( object ):
+# Collects the strings written to it in memory, and passes them on to the
+# underlying file in a single write once chunk_size characters are pending,
+# rather than making a file call per item:
+class ChunkedWriter( object ):
 
 		#------------------------------------------------------------------------
 
-		@staticmethod
-		def _on_segment( p, q, r ):
-				""" Given three colinear points p, q, and r, check if
-						point q lies on line segment pr. """
+		def __init__( self, output_file, chunk_size = 1 << 20 ):
 
-				if (
-						q.x <= max( p.x, r.x ) and
-						q.x >= min( p.x, r.x ) and
-						q.y <= max( p.y, r.y ) and
-						q.y >= min( p.y, r.y )
-				):
-						return True
-
-				return False
+				self.output_file = output_file
+				self.chunk_size = chunk_size
+				self.pending = []
+				self.size = 0
 
 
 		#------------------------------------------------------------------------
 
-		@staticmethod
-		def _orientation( p, q, r ):
-				""" Find orientation of ordered triplet (p, q, r).
-						Returns following values
-						0 --> p, q and r are colinear
-						1 --> Clockwise
-						2 --> Counterclockwise
-				"""
-
-				val = (
-						( q.y - p.y ) * ( r.x - q.x ) -
-						( q.x - p.x ) * ( r.y - q.y )
-				)
-
-				if val == 0: return 0
-				if val > 0: return 1
-				return 2
-
-
-		#------------------------------------------------------------------------
-
-		def __init__( self, p = None, q = None ):
-
-				self.p = p
-				self.q = q
-
-
-		#------------------------------------------------------------------------
+		def write( self, text ):
 
-		def connects( self, segment ):
+				self.pending.append( text )
+				self.size += len( text )
 
-				if self.q.x == segment.p.x and self.q.y == segment.p.y: return True
-				if self.q.x == segment.q.x and self.q.y == segment.q.y: return True
-				if self.p.x == segment.p.x and self.p.y == segment.p.y: return True
-				if self.p.x == segment.q.x and self.p.y == segment.q.y: return True
-				return False
+				if self.size >= self.chunk_size:
+						self.flush()
 
 
 		#------------------------------------------------------------------------
 
-		def intersects( self, segment ):
-				""" Return true if line segments 'p1q1' and 'p2q2' intersect.
-						Adapted from:
-							http://www.geeksforgeeks.org/check-if-two-given-line-segments-intersect/
-				"""
-
-				# Find the four orientations needed for general and special cases:
-				o1 = self._orientation( self.p, self.q, segment.p )
-				o2 = self._orientation( self.p, self.q, segment.q )
-				o3 = self._orientation( segment.p, segment.q, self.p )
-				o4 = self._orientation( segment.p, segment.q, self.q )
-
-				return (
-
-						# General case:
-						( o1 != o2 and o3 != o4 )
-
-						or
+		def flush( self ):
 
-						# p1, q1 and p2 are colinear and p2 lies on segment p1q1:
-						( o1 == 0 and self._on_segment( self.p, segment.p, self.q ) )
-
-						or
-
-						# p1, q1 and p2 are colinear and q2 lies on segment p1q1:
-						( o2 == 0 and self._on_segment( self.p, segment.q, self.q ) )
-
-						or
-
-						# p2, q2 and p1 are colinear and p1 lies on segment p2q2:
-						( o3 == 0 and self._on_segment( segment.p, self.p, segment.q ) )
-
-						or
-
-						# p2, q2 and q1 are colinear and q1 lies on segment p2q2:
-						( o4 == 0 and self._on_segment( segment.p, self.q, segment.q ) )
-				)
+				if self.pending:
+						self.output_file.write( "".join( self.pending ) )
+						self.pending = []
+						self.size = 0
 
 
 		#------------------------------------------------------------------------
 
-		def q_next( self, q ):
-
-				self.p = self.q
-				self.q = q
+		def close( self ):
 
+				self.flush()
+				self.output_file.close()
 
-		#------------------------------------------------------------------------
 
 #----------------------------------------------------------------------------
 
@@ -317,50 +279,52 @@ class PolygonSegment( object ):
 
 		#------------------------------------------------------------------------
 
-		# KiCad will not "pick up the pen" when moving between a polygon outline
-		# and holes within it, so we search for a pair of points connecting the
-		# outline (self) to the hole such that the connecting segment will not
-		# cross the visible inner space within any hole.
-		def _find_insertion_point( self, hole, holes ):
-
-				#print( "      Finding insertion point.  {} holes".format( len( holes ) ) )
+		# Index the edges of the given polygon segments, so that only the ones
+		# near a bridge need to be checked against it.  Each edge is tagged with
+		# the polygon segment it belongs to.
+		@staticmethod
+		def _index_edges( segments ):
 
-				# Try the next point on the container:
-				for cp in range( len( self.points ) ):
-						container_point = self.points[ cp ]
+				edges = svg.EdgeSet()
+				for segment in segments:
+						edges.add_ring( segment.points, segment )
 
-						#print( "      Trying container point {}".format( cp ) )
+				return edges.index()
 
-						# Try the next point on the hole:
-						for hp in range( len( hole.points ) - 1 ):
-								hole_point = hole.points[ hp ]
 
-								#print( "      Trying hole point {}".format( cp ) )
+		#------------------------------------------------------------------------
 
-								bridge = LineSegment( container_point, hole_point )
+		# KiCad will not "pick up the pen" when moving between a polygon outline
+		# and holes within it, so we search for a pair of points connecting the
+		# outline (self) to the hole such that the connecting segment will not
+		# cross the visible inner space within any hole.  The edges of the holes
+		# are found through their index (see _index_edges).
+		def _find_insertion_point( self, hole, edges ):
 
-								# Check for intersection with each other hole:
-								for other_hole in holes:
+				#print( "      Finding insertion point.  {} holes".format( len( holes ) ) )
 
-										#print( "      Trying other hole.  Check = {}".format( hole == other_hole ) )
+				# Try the (container point, hole point) pairs, closest first: short
+				# bridges rarely cross anything, and make short cuts:
+				for cp, hp in svg.nearest_pairs( self.points, hole.points[ : -1 ] ):
 
-										# If the other hole intersects, don't bother checking
-										# remaining holes:
-										if other_hole.intersects(
-												bridge,
-												check_connects = (
-														other_hole == hole or other_hole == self
-												)
-										): break
+						container_point = self.points[ cp ]
+						hole_point = hole.points[ hp ]
 
-										#print( "        Hole does not intersect." )
+						#print( "      Trying container point {}, hole point {}".format( cp, hp ) )
 
-								else:
-										print( "      Found insertion point: {}, {}".format( cp, hp ) )
+						# Check for intersection with the edges around the bridge.
+						# Edges of the hole and container may touch the bridge at its
+						# ends:
+						if not edges.crosses(
+								container_point.x, container_point.y,
+								hole_point.x, hole_point.y,
+								connecting = ( hole, self ),
+						):
+								print( "      Found insertion point: {}, {}".format( cp, hp ) )
 
-										# No other holes intersected, so this insertion point
-										# is acceptable:
-										return ( cp, hole.points_starting_on_index( hp ) )
+								# No other holes intersected, so this insertion point
+								# is acceptable:
+								return ( cp, hole.points_starting_on_index( hp ) )
 
 				print(
 						"Could not insert segment without overlapping other segments"
@@ -382,9 +346,7 @@ class PolygonSegment( object ):
 
 						points = points[ index : ] + points[ : index ]
 
-						points.append(
-								svg.Point( points[ 0 ].x, points[ 0 ].y )
-						)
+						points.append( points[ 0 ] )
 
 				return points
 
@@ -400,13 +362,14 @@ class PolygonSegment( object ):
 				print( "    Inlining {} segments...".format( len( segments ) ) )
 
 				all_segments = segments[ : ] + [ self ]
+				edges = self._index_edges( all_segments )
 				insertions = []
 
 				# Find the insertion point for each hole:
 				for hole in segments:
 
 						insertion = self._find_insertion_point(
-								hole, all_segments
+								hole, edges
 						)
 						if insertion is not None:
 								insertions.append( insertion )
@@ -431,10 +394,7 @@ class PolygonSegment( object ):
 						else:
 								inlined += insertion[ 1 ]
 
-						inlined.append( svg.Point(
-								points[ ip - 1 ].x,
-								points[ ip - 1 ].y,
-						) )
+						inlined.append( points[ ip - 1 ] )
 
 				while ip < len( points ):
 						inlined.append( points[ ip ] )
@@ -443,33 +403,6 @@ class PolygonSegment( object ):
 				return inlined
 
 
-		#------------------------------------------------------------------------
-
-		def intersects( self, line_segment, check_connects ):
-
-				hole_segment = LineSegment()
-
-				# Check each segment of other hole for intersection:
-				for point in self.points:
-
-						hole_segment.q_next( point )
-
-						if hole_segment.p is not None:
-
-								if (
-										check_connects and
-										line_segment.connects( hole_segment )
-								): continue
-
-								if line_segment.intersects( hole_segment ):
-
-										#print( "Intersection detected." )
-
-										return True
-
-				return False
-
-
 		#------------------------------------------------------------------------
 
 		# Apply all transformations and rounding, then remove duplicate
@@ -479,7 +412,7 @@ class PolygonSegment( object ):
 				points = []
 				for point in self.points:
 
-						point = transformer.transform_point( point, flip )
+						point = transformer.transform_polygon_point( point, flip )
 
 						if (
 								len( points ) < 1 or
@@ -497,10 +430,7 @@ class PolygonSegment( object ):
 								#points[ -1 ].x, points[ -1 ].y,
 						#) )
 
-						points.append( svg.Point(
-								points[ 0 ].x,
-								points[ 0 ].y,
-						) )
+						points.append( points[ 0 ] )
 
 				#else:
 						#print( "Polygon closed: start=({}, {}) end=({}, {})".format(
@@ -519,14 +449,19 @@ class Svg2ModImport( object ):
 
 		#------------------------------------------------------------------------
 
-		def __init__( self, file_name, module_name, module_value ):
+		def __init__( self, file_name, module_name, module_value, layers = None ):
 
 				self.file_name = file_name
 				self.module_name = module_name
 				self.module_value = module_value
 
 				print( "Parsing SVG..." )
-				self.svg = svg.parse( file_name )
+				self.svg = svg.parse( file_name, layers )
+
+				cache = svg.transform_cache
+				print( "Transform cache: {} hits, {} misses ({:.0%} hit rate)".format(
+						cache.hits, cache.misses, cache.hit_rate()
+				) )
 
 
 		#------------------------------------------------------------------------
@@ -551,37 +486,73 @@ class Svg2ModExport( object ):
 
 		#------------------------------------------------------------------------
 
-		def _get_fill_stroke( self, item ):
+		def _convert_mm_to_svg( self, mm ):
+				if self.use_mm:
+						return mm / self.scale_factor
+				return mm * 393.700787 / self.scale_factor
+
+
+		#------------------------------------------------------------------------
+
+		# Style properties affecting the output, as (fill, stroke, stroke-width):
+		_style_names = ( "fill", "stroke", "stroke-width" )
+		_no_style = ( None, None, None )
+
+
+		#------------------------------------------------------------------------
+
+		@classmethod
+		def _inherit_style( cls, style, inherited = _no_style ):
+				""" Return the style properties set by a style attribute, falling back
+						to the inherited ones. """
+
+				if style is None or style == "":
+						return inherited
+
+				key = ( style, inherited )
+				properties = _inherited_style_cache.get( key )
+				if properties is not None:
+						return properties
+
+				values = dict( zip( cls._style_names, inherited ) )
+
+				for property in style.split( ";" ):
 
-				fill = True
-				stroke = True
-				stroke_width = 0.0
+						nv = property.split( ":" );
+						if len( nv ) != 2: continue
+						name = nv[ 0 ].strip()
 
-				if item.style is not None and item.style != "":
+						if name in values:
+								values[ name ] = nv[ 1 ].strip()
 
-						for property in item.style.split( ";" ):
+				properties = tuple( values[ name ] for name in cls._style_names )
+				_inherited_style_cache[ key ] = properties
+				return properties
 
-								nv = property.split( ":" );
-								name = nv[ 0 ].strip()
-								value = nv[ 1 ].strip()
 
-								if name == "fill" and value == "none":
-										fill = False
+		#------------------------------------------------------------------------
+
+		def _get_fill_stroke( self, item, inherited = _no_style ):
+
+				key = ( item.style, inherited, self.dpi )
+				style = _style_cache.get( key )
+				if style is not None:
+						return style
 
-								elif name == "stroke" and value == "none":
-										stroke = False
+				fill, stroke, stroke_width = self._inherit_style( item.style, inherited )
 
-								elif name == "stroke-width":
-										value = value.replace( "px", "" )
-										stroke_width = float( value ) * 25.4 / float(self.dpi)
+				fill = fill != "none"
+				stroke = stroke != "none"
 
-				if not stroke:
+				if not stroke or stroke_width is None:
 						stroke_width = 0.0
-				elif stroke_width is None:
-						# Give a default stroke width?
-						stroke_width = self._convert_decimil_to_mm( 1 )
+				else:
+						stroke_width = stroke_width.replace( "px", "" )
+						stroke_width = float( stroke_width ) * 25.4 / float(self.dpi)
 
-				return fill, stroke, stroke_width
+				style = Style( fill, stroke, stroke_width )
+				_style_cache[ key ] = style
+				return style
 
 
 		#------------------------------------------------------------------------
@@ -594,6 +565,16 @@ class Svg2ModExport( object ):
 				precision = 20.0,
 				use_mm = True,
 				dpi = DEFAULT_DPI,
+				flatten = "uniform",
+				tolerance = 0.01,
+				simplify = None,
+				vw_area = None,
+				max_vertices = None,
+				merge_layers = False,
+				validate = False,
+				nm_grid = False,
+				coord_precision = 6,
+				instance_shapes = False,
 		):
 				if use_mm:
 						# 25.4 mm/in;
@@ -611,11 +592,86 @@ class Svg2ModExport( object ):
 				self.dpi = dpi
 				self.edgecut_mode = False
 
+				# Adaptive flattening tolerance, in SVG units:
+				if flatten == "adaptive":
+						self.tolerance = self._convert_mm_to_svg( tolerance )
+				else:
+						self.tolerance = None
+
+				# Simplification tolerance, in SVG units:
+				if simplify:
+						self.simplify = self._convert_mm_to_svg( simplify )
+				else:
+						self.simplify = None
+
+				# Visvalingam-Whyatt area tolerance, in SVG units, and
+				# vertex budget, per polygon:
+				if vw_area:
+						self.vw_area = vw_area * self._convert_mm_to_svg( 1.0 ) ** 2
+				else:
+						self.vw_area = None
+				self.max_vertices = max_vertices
+
+				# Point counts before and after simplification, by layer:
+				self.simplify_counts = {}
+
+				# Whether to merge the filled polygons of each layer, and
+				# their polygon and point counts before and after, by layer:
+				self.merge_layers = merge_layers
+				self.merge_counts = {}
+
+				# Whether polygons are snapped to KiCad's 1 nm grid, and computed
+				# on integers (in mm only):
+				self.nm_grid = nm_grid and use_mm
+
+				# Number of decimals written for coordinates (in mm), and the
+				# format for them (on the nm grid, the step they are rounded to):
+				self.coord_precision = coord_precision
+				self.coord_format = "%.{}f".format( coord_precision )
+				self.nm_step = 10 ** max( 0, 6 - coord_precision )
+
+				# Whether translated copies of a path are written once, as a
+				# module placed at each copy, and the distance (in SVG units)
+				# within which copies are the same; the shapes, by layer and
+				# shape key:
+				self.instance_shapes = instance_shapes
+				self.instance_quantum = self._convert_mm_to_svg(
+						10.0 ** -coord_precision
+				)
+				self.instances = collections.OrderedDict()
+
+				# Whether to check filled polygons for self-intersections, and
+				# the ( layer, SVG id, count ) of the ones found:
+				self.validate = validate
+				self.self_intersecting = []
+
+		#------------------------------------------------------------------------
+
+		def _calculate_bboxes( self ):
+
+				# Bounding box of the whole drawing, computed once (after
+				# pruning) for all the writers:
+				self.bbox = self.imported.svg.bbox()
+
+
+		#------------------------------------------------------------------------
+
+		# Bounding box of a layer found by _prune(), or None.  It is only
+		# computed when asked for, then kept by its group.
+		def layer_bbox( self, name ):
+
+				group = self.layers.get( name )
+				if group is None:
+						return None
+
+				return group.bbox()
+
+
 		#------------------------------------------------------------------------
 
 		def _calculate_translation( self ):
 
-				min_point, max_point = self.imported.svg.bbox()
+				min_point, max_point = self.bbox
 
 				# Center the drawing:
 				adjust_x = min_point.x + ( max_point.x - min_point.x ) / 2.0
@@ -630,25 +686,28 @@ class Svg2ModExport( object ):
 		#------------------------------------------------------------------------
 
 		# Find and keep only the layers of interest.
-		def _prune( self, items = None ):
-
+		def _prune( self ):
 
+				self.layers = {}
+				for name in self.layer_map.iterkeys():
+						self.layers[ name ] = None
 
-				if items is None:
+				# The outermost groups named after a layer (or drill holes):
+				def is_layer( item ):
+						return isinstance( item, svg.Group ) and (
+								item.name == "Drill" or item.name in self.layers
+						)
 
-						self.layers = {}
-						for name in self.layer_map.iterkeys():
-								self.layers[ name ] = None
+				groups = [
+						group for group, matrix, style, layer
+						in self.imported.svg.walk( is_layer )
+				]
+				self.imported.svg.items = []
 
-						items = self.imported.svg.items
-						self.imported.svg.items = []
-				
 				contain_fmask = False
 				contain_bmask = False
 
-				for item in items:
-					if not isinstance( item, svg.Group ):
-						continue
+				for item in groups:
 					if item.name == "Drill":
 						self.imported.svg.items.append( item )
 					if item.name == "F.Mask":
@@ -657,87 +716,314 @@ class Svg2ModExport( object ):
 					if item.name == "B.Mask":
 						if (len(item.items)) > 0:
 							contain_bmask = True
-					
 
-				for item in items:
-
-						if not isinstance( item, svg.Group ):
-								continue							
-
-						for name in self.layers.iterkeys():
-								
-								#if re.search( name, item.name, re.I ):
-								if name == item.name:
-										print( "Found SVG layer: {}".format( item.name ) )
-										self.imported.svg.items.append( item )
-										self.layers[ name ] = item
-
-										if (item.name == "F.Cu" and contain_fmask == False):
-											fmask = item
-											fmask.name = "F.Mask"
-											self.imported.svg.items.append( fmask )
-											self.layers[ fmask.name ] = fmask											
-
-										if (item.name == "B.Cu" and contain_bmask == False):
-											fmask = item
-											fmask.name = "B.Mask"
-											self.imported.svg.items.append( fmask )
-											self.layers[ fmask.name ] = fmask	
-
-								
-										break
-						else:
-								self._prune( item.items )
+				for item in groups:
+
+						if item.name == "Drill": continue
+
+						print( "Found SVG layer: {}".format( item.name ) )
+						self.imported.svg.items.append( item )
+						self.layers[ item.name ] = item
+
+						if (item.name == "F.Cu" and contain_fmask == False):
+							fmask = item
+							fmask.name = "F.Mask"
+							self.imported.svg.items.append( fmask )
+							self.layers[ fmask.name ] = fmask
+
+						if (item.name == "B.Cu" and contain_bmask == False):
+							fmask = item
+							fmask.name = "B.Mask"
+							self.imported.svg.items.append( fmask )
+							self.layers[ fmask.name ] = fmask
 
 
 		#------------------------------------------------------------------------
 
-		def _write_items( self, items, layer, flip = False ):
+		def _write_items( self, group, layer, flip = False ):
+
+				# Filled polygons to merge, by stroke width:
+				merged = {}
+
+				walked = list( group.walk(
+						style = self._no_style,
+						inherit = lambda group, style:
+								self._inherit_style( group.style, style ),
+				) )
+
+				# The paths drawn more than once, with their origin and shape:
+				copies = {}
+				if self.instance_shapes and not self.edgecut_mode:
+						copies = self._find_copies( walked )
+
+				for item, matrix, style, name in walked:
 
-				for item in items:
+						if isinstance( item, svg.Path ):
 
-						if isinstance( item, svg.Group ):
-								self._write_items( item.items, layer, flip )
-								continue
+								# Only the first copy of a shape is flattened and
+								# processed, the others are placed:
+								instance = None
+								if item in copies:
 
-						elif isinstance( item, svg.Path ):
+										origin, shape = copies[ item ]
+										anchor = self.transform_polygon_point( origin, flip )
+
+										instance = self.instances.get( ( layer, shape ) )
+										if instance is not None:
+												instance.anchors.append( anchor )
+												continue
+
+										instance = Instance( layer, [], [ anchor ] )
+										self.instances[ layer, shape ] = instance
+
+								segments = item.segments(
+										precision = self.precision,
+										tolerance = self.tolerance,
+								)
+
+								if (
+										self.simplify is not None or
+										self.vw_area is not None or
+										self.max_vertices is not None
+								):
+										segments = self._simplify( segments, layer )
 
 								segments = [
 										PolygonSegment( segment )
-										for segment in item.segments(
-												precision = self.precision
-										)
+										for segment in segments
 								]
 
 								for segment in segments:
 										segment.process( self, flip )
 
-								if len( segments ) > 1:
-										points = segments[ 0 ].inline( segments[ 1 : ] )
-
-								elif len( segments ) > 0:
-										points = segments[ 0 ].points
+								nested = svg.nest_rings( [
+										segment.points for segment in segments
+								] )
 
-								fill, stroke, stroke_width = self._get_fill_stroke( item )
+								fill, stroke, stroke_width = self._get_fill_stroke( item, style )
 
 								if not self.use_mm:
 										stroke_width = self._convert_mm_to_decimil(
 												stroke_width
 										)
 
-								print( "    Writing polygon with {} points".format(
-										len( points ) )
-								)
-								# print "debok " , fill
-								self._write_polygon(
-										points, layer, fill, stroke, stroke_width
-								)
+								if self.merge_layers and fill and not self.edgecut_mode:
+										merged.setdefault( stroke_width, [] ).extend(
+												[ segments[ outer ].points ] +
+												[ segments[ hole ].points for hole in holes ]
+												for outer, holes in nested
+										)
+										continue
+
+								# Each outer boundary (island) is written as its own
+								# polygon, with the holes directly within it inlined:
+								polygons = [
+										segments[ outer ].inline( [
+												segments[ hole ] for hole in holes
+										] )
+										for outer, holes in nested
+								]
+
+								for points in polygons:
+
+										print( "    Writing polygon with {} points".format(
+												len( points ) )
+										)
+										if self.validate and fill:
+												self._validate( points, layer, item.id )
+
+										if instance is not None:
+												anchor = instance.anchors[ 0 ]
+												instance.polygons.append( (
+														[
+																self._grid_point(
+																		point.x - anchor.x, point.y - anchor.y
+																)
+																for point in points
+														],
+														fill, stroke, stroke_width,
+												) )
+												continue
+
+										# print "debok " , fill
+										self._write_polygon(
+												points, layer, fill, stroke, stroke_width
+										)
 
 						else:
 								print( "Unsupported SVG element: {}".format(
 										item.__class__.__name__
 								) )
 
+				for stroke_width, polygons in sorted( merged.items() ):
+						self._write_merged( polygons, layer, stroke_width )
+
+
+		#------------------------------------------------------------------------
+
+		# Find the paths which are translated copies of another one, with the
+		# same style: { path : ( origin, shape ) }, where shape is the same for
+		# all the copies.  Filled paths are not instanced when they are merged.
+		def _find_copies( self, walked ):
+
+				shapes = {}
+				counts = collections.defaultdict( int )
+
+				for item, matrix, style, name in walked:
+
+						if not isinstance( item, svg.Path ): continue
+
+						style = self._get_fill_stroke( item, style )
+						if self.merge_layers and style.fill: continue
+
+						origin, key = item.shape_key( self.instance_quantum )
+						if key is None: continue
+
+						shapes[ item ] = ( origin, ( key, style ) )
+						counts[ key, style ] += 1
+
+				return dict(
+						( item, shape ) for item, shape in shapes.items()
+						if counts[ shape[ 1 ] ] > 1
+				)
+
+
+		#------------------------------------------------------------------------
+
+		# Write each shape drawn more than once as a module of its own, placed
+		# at each of its copies.  Its polygons are only flattened and formatted
+		# once, but the board file still holds every copy in full (modules
+		# cannot refer to each other), each in a module wrapper of its own:
+		# the file grows, the conversion gets faster.
+		def _write_instances( self ):
+
+				tstamp = 0
+				for number, instance in enumerate( self.instances.values() ):
+
+						name = "{}_shape{}".format( self._get_module_name(), number + 1 )
+
+						body = "".join(
+								self._format_polygon(
+										points, instance.layer, fill, stroke, stroke_width
+								)
+								for points, fill, stroke, stroke_width in instance.polygons
+						)
+
+						for copy, anchor in enumerate( instance.anchors ):
+								tstamp += 1
+								self._write_instance(
+										name, "{}_{}".format( name, copy + 1 ), tstamp,
+										instance.layer, anchor, body,
+								)
+
+
+		#------------------------------------------------------------------------
+
+		# Write the union of the given filled polygons (lists of rings: outline
+		# then holes), each of its outer boundaries with its holes inlined.
+		def _write_merged( self, polygons, layer, stroke_width ):
+
+				print( "    Merging {} polygons".format( len( polygons ) ) )
+
+				# Merge on KiCad's internal grid (1 nm), or on the decimil output
+				# grid:
+				if self.use_mm and not self.nm_grid:
+						resolution = 1e-6
+				else:
+						resolution = 1
+
+				rings = []
+				for ring in svg.union_polygons( polygons, resolution ):
+
+						# Intersections are rounded like the other points:
+						points = []
+						for point in ring:
+								point = self._grid_point( point.x, point.y )
+								if (
+										len( points ) < 1 or
+										point.x != points[ -1 ].x or
+										point.y != points[ -1 ].y
+								):
+										points.append( point )
+
+						rings.append( points )
+
+				nested = svg.nest_rings( rings )
+
+				counts = self.merge_counts.setdefault( layer, [ 0, 0, 0, 0 ] )
+				counts[ 0 ] += len( polygons )
+				counts[ 1 ] += sum(
+						len( ring ) - 1 for polygon in polygons for ring in polygon
+				)
+				counts[ 2 ] += len( nested )
+				counts[ 3 ] += sum( len( ring ) - 1 for ring in rings )
+
+				for outer, holes in nested:
+
+						points = PolygonSegment( rings[ outer ] ).inline( [
+								PolygonSegment( rings[ hole ] ) for hole in holes
+						] )
+
+						print( "    Writing polygon with {} points".format(
+								len( points ) )
+						)
+						if self.validate:
+								self._validate( points, layer, "(merged)" )
+
+						self._write_polygon(
+								points, layer, True, False, stroke_width
+						)
+
+
+		#------------------------------------------------------------------------
+
+		# Report the edges of a filled polygon which cross or touch each other
+		# (other than at shared ends, or along inlined bridges).
+		def _validate( self, points, layer, name ):
+
+				pairs = svg.self_intersections( points )
+				if not pairs: return
+
+				print(
+						"Warning: Path {} on layer {} intersects itself {} times"
+						" (first between edges {} and {})".format(
+								name, layer, len( pairs ), pairs[ 0 ][ 0 ], pairs[ 0 ][ 1 ]
+						)
+				)
+				self.self_intersecting.append( ( layer, name, len( pairs ) ) )
+
+
+		#------------------------------------------------------------------------
+
+		def _simplify( self, segments, layer ):
+
+				simplified = segments
+
+				if self.simplify is not None:
+						simplified = []
+						for segment in segments:
+
+								points = svg.simplify_segment( segment, self.simplify )
+
+								# Keep outlines which would not be polygons any more:
+								if len( points ) < 4 and len( points ) < len( segment ):
+										points = segment
+
+								simplified.append( points )
+
+				# Outline and holes are simplified together, so that they
+				# stay simple and apart (as needed to inline them):
+				if self.vw_area is not None or self.max_vertices is not None:
+						simplified = svg.simplify_polygon(
+								simplified, self.vw_area, self.max_vertices
+						)
+
+				counts = self.simplify_counts.setdefault( layer, [ 0, 0 ] )
+				counts[ 0 ] += sum( len( segment ) for segment in segments )
+				counts[ 1 ] += sum( len( points ) for points in simplified )
+
+				return simplified
+
 
 		#------------------------------------------------------------------------
 
@@ -745,7 +1031,7 @@ class Svg2ModExport( object ):
 
 				module_name = self._get_module_name( front )
 
-				min_point, max_point = self.imported.svg.bbox()
+				min_point, max_point = self.bbox
 				min_point = self.transform_point( min_point, flip = False )
 				max_point = self.transform_point( max_point, flip = False )
 
@@ -775,7 +1061,7 @@ class Svg2ModExport( object ):
 						layer = self._get_layer_name( name, front )
 
 						#print( "  Writing layer: {}".format( name ) )
-						self._write_items( group.items, layer, not front )
+						self._write_items( group, layer, not front )
 
 				self._write_module_footer( front )
 
@@ -787,7 +1073,7 @@ class Svg2ModExport( object ):
 
 				module_name = self._get_module_name( front )
 
-				min_point, max_point = self.imported.svg.bbox()
+				min_point, max_point = self.bbox
 				min_point = self.transform_point( min_point, flip = False )
 				max_point = self.transform_point( max_point, flip = False )
 
@@ -810,7 +1096,7 @@ class Svg2ModExport( object ):
 						if group is None: continue
 						if (name == "Edge.Cuts"):
 							layer = self._get_layer_name( name, front )
-							self._write_items( group.items, layer, not front )
+							self._write_items( group, layer, not front )
 
 				
 		#------------------------------------------------------------------------
@@ -819,7 +1105,7 @@ class Svg2ModExport( object ):
 
 				dip_footprint = """
 				(module SMD_Packages:SO-16-N (layer F.Cu) (tedit 0) (tstamp 5AAF3D82)
-					(at %f %f %f)
+					(at %s %s %f)
 					(descr "Module CMS SOJ 16 pins large")
 					(tags "CMS SOJ")
 					(path /5AAF3111)
@@ -848,7 +1134,7 @@ class Svg2ModExport( object ):
 
 				module_name = self._get_module_name( front )
 
-				min_point, max_point = self.imported.svg.bbox()
+				min_point, max_point = self.bbox
 				min_point = self.transform_point( min_point, flip = False )
 				max_point = self.transform_point( max_point, flip = False )
 
@@ -871,9 +1157,9 @@ class Svg2ModExport( object ):
 						if group is None: continue
 						if (name == "F.Cu" or name == "B.Cu"):
 							layer = self._get_layer_name( name, front )
-							for item in group.items:
+							for item, matrix, style, name in group.walk( svg.Rect ):
 								# item.transform()
-								if isinstance( item, svg.Rect ) and hasattr(item, "type"):
+								if hasattr(item, "type"):
 									# print "DEBOK RECT"
 
 									start_xy = self.transform_point(item.segments()[0][0]*1.0666794869689005, not front)
@@ -886,57 +1172,51 @@ class Svg2ModExport( object ):
 									# print vars(item)
 
 									if (item.type == "dip16"):
-										self.output_file.write(dip_footprint % (center_x, center_y, -1 * float(item.rotation) ))
+										self.output_file.write(dip_footprint % (
+												self._format_mm( center_x ),
+												self._format_mm( center_y ),
+												-1 * float(item.rotation)
+										))
 									
 									# print item.P1*1.0666794869689005, item.P2*1.0666794869689005
 
-								if isinstance( item, svg.Path ):
-									# print "DEBOK PATH"
-									# print (item.items)
-									# new = svg.Point(item.segments()[0][0])
-									# print item.segments()[0][0]
-									# (12.568,1.972)
-									# (273.000,193.906)
-									# print item.segments()
-									# print ( self.transform_point(item.segments()[0][0], not front ))
-									continue
 
 				
 
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_filled( self, points, layer, stroke_width = 0.0 ):
-
-				self._write_polygon_header( points, layer )
+		def _format_polygon_filled( self, points, layer, stroke_width = 0.0 ):
 
-				for point in points:
-						self._write_polygon_point( point )
-
-				self._write_polygon_footer( layer, stroke_width )
+				return (
+						self._format_polygon_header( points, layer ) +
+						self._format_polygon_points( points ) +
+						self._format_polygon_footer( layer, stroke_width )
+				)
 
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_outline( self, points, layer, stroke_width ):
+		def _format_polygon_outline( self, points, layer, stroke_width ):
 
+				if self.edgecut_mode:
+						format_segment = self._format_edgecut_segment
+				else:
+						format_segment = self._format_polygon_segment
+
+				segments = []
 				prior_point = None
 				for point in points:
 
 						if prior_point is not None:
-								# self.edgecut_mode = False
-								if (self.edgecut_mode):
-									self._write_edgecut_segment(
-											prior_point, point, layer, stroke_width
-									)
-								else:
-									self._write_polygon_segment(
-											prior_point, point, layer, stroke_width
-									)									
-								
+								segments.append( format_segment(
+										prior_point, point, layer, stroke_width
+								) )
 
 						prior_point = point
 
+				return "".join( segments )
+
 
 		#------------------------------------------------------------------------
 
@@ -950,16 +1230,95 @@ class Svg2ModExport( object ):
 				if flip:
 						transformed_point.x *= -1
 
+				transformed_point.x = self._round_coordinate( transformed_point.x )
+				transformed_point.y = self._round_coordinate( transformed_point.y )
+
+				return transformed_point
+
+
+		#------------------------------------------------------------------------
+
+		def _round_coordinate( self, value ):
+
 				if self.use_mm:
-						transformed_point.x = round( transformed_point.x, 12 )
-						transformed_point.y = round( transformed_point.y, 12 )
-				else:
-						transformed_point.x = int( round( transformed_point.x ) )
-						transformed_point.y = int( round( transformed_point.y ) )
+						return round( value, 12 )
+
+				return int( round( value ) )
+
+
+		#------------------------------------------------------------------------
+
+		# Transform a point of a polygon.  On the nm grid, its coordinates are
+		# integers, in nm.
+		def transform_polygon_point( self, point, flip = False ):
+
+				transformed_point = self.transform_point( point, flip )
+
+				if self.nm_grid:
+						return self._grid_point(
+								transformed_point.x * 1000000,
+								transformed_point.y * 1000000,
+						)
 
 				return transformed_point
 
 
+		#------------------------------------------------------------------------
+
+		# A polygon point with the given coordinates, rounded to the grid.
+		def _grid_point( self, x, y ):
+
+				# svg.Point() makes floats of its coordinates:
+				point = svg.Point( 0.0, 0.0 )
+
+				if self.nm_grid:
+						point.x = int( round( x ) )
+						point.y = int( round( y ) )
+				else:
+						point.x = self._round_coordinate( x )
+						point.y = self._round_coordinate( y )
+
+				return point
+
+
+		#------------------------------------------------------------------------
+
+		# Coordinates as written: in mm, with up to coord_precision decimals and
+		# no trailing zeros.
+		def _format_mm( self, value ):
+
+				if not self.use_mm:
+						return value
+
+				text = self.coord_format % value
+				if "." in text:
+						text = text.rstrip( "0" ).rstrip( "." )
+				if text == "-0":
+						return "0"
+
+				return text
+
+
+		#------------------------------------------------------------------------
+
+		# Polygon coordinates as written: integer nm are written in mm, exactly.
+		def _format_coordinate( self, value ):
+
+				if not self.nm_grid:
+						return self._format_mm( value )
+
+				# Round half up to the output precision:
+				if self.nm_step > 1:
+						value = ( value + self.nm_step // 2 ) // self.nm_step * self.nm_step
+
+				sign = "-" if value < 0 else ""
+				mm, nm = divmod( abs( value ), 1000000 )
+				if not nm:
+						return "{}{}".format( sign, mm )
+
+				return "{}{}.{:06d}".format( sign, mm, nm ).rstrip( "0" )
+
+
 		#------------------------------------------------------------------------
 
 		def write( self ):
@@ -967,15 +1326,17 @@ class Svg2ModExport( object ):
 				self._prune()
 
 				# Must come after pruning:
+				self._calculate_bboxes()
 				translation = self._calculate_translation()
 
 				print( "Writing module file: {}".format( self.file_name ) )
-				self.output_file = open( self.file_name, 'w' )
+				self.output_file = ChunkedWriter( open( self.file_name, 'w' ) )
 
 				self._write_pcb_header()
 				self._write_library_intro()
 
 				self._write_module( front = True )
+				self._write_instances()
 				self.edgecut_mode = True
 				self._write_edge_cuts( front = True)
 
@@ -988,6 +1349,32 @@ class Svg2ModExport( object ):
 				self.output_file.close()
 				self.output_file = None
 
+				for layer, counts in sorted( self.simplify_counts.items() ):
+						print( "Simplified layer {}: {} -> {} points".format(
+								layer, counts[ 0 ], counts[ 1 ]
+						) )
+
+				for layer, counts in sorted( self.merge_counts.items() ):
+						print(
+								"Merged layer {}: {} polygons ({} points) ->"
+								" {} polygons ({} points)".format( layer, *counts )
+						)
+
+				if self.instance_shapes:
+						print( "Instanced {} shapes: {} copies".format(
+								len( self.instances ),
+								sum( len( i.anchors ) for i in self.instances.values() ),
+						) )
+
+				if self.validate:
+						print( "Validation: {} self-intersecting polygons".format(
+								len( self.self_intersecting )
+						) )
+						for layer, name, count in self.self_intersecting:
+								print( "  {} on layer {}: {} intersections".format(
+										name, layer, count
+								) )
+
 
 		#------------------------------------------------------------------------
 
@@ -1039,23 +1426,25 @@ class Svg2ModExportPretty( Svg2ModExport ):
 		def _write_wirepad( self ):
 			root = (self.imported.svg.root)
 
-			pad_string = ""
+			pads = []
 			count = 0
 
 			pad_template = """
 				(module Wire_Pads:SolderWirePad_single_0-8mmDrill (layer F.Cu) (tedit 0) (tstamp 5ABD66D0)
-					(at %f %f)
+					(at %s %s)
 					(pad %d thru_hole circle (at 0 0) (size 1.99898 1.99898) (drill 0.8001) (layers *.Cu *.Mask))
 				)
 			"""
 
-			items = self.imported.svg.items
-			for item in items:
+			drill_groups = self.imported.svg.walk(
+					lambda item: isinstance( item, svg.Group ) and item.name == "Drill"
+			)
+			for item, matrix, style, name in drill_groups:
 				# print item.name
 				if (item.name == "Drill"): 
 					# item.transform()
 
-					for drill in item.items:
+					for drill, matrix, style, name in item.walk( svg.Ellipse ):
 						count = count + 1
 						# print drill.matrix.vect
 						old_center = drill.center
@@ -1069,9 +1458,13 @@ class Svg2ModExportPretty( Svg2ModExport ):
 						new_pad = self.transform_point(test)
 						pad_x = new_pad.x
 						pad_y = new_pad.y
-						pad_string = pad_string + pad_template % (pad_x, pad_y, count)
-			
-			self.output_file.write(pad_string)
+						pads.append( pad_template % (
+								self._format_mm( pad_x ),
+								self._format_mm( pad_y ),
+								count
+						) )
+
+			self.output_file.write( "".join( pads ) )
 
 
 		
@@ -1147,82 +1540,126 @@ class Svg2ModExportPretty( Svg2ModExport ):
 
 		def _write_polygon( self, points, layer, fill, stroke, stroke_width ):
 
+				self.output_file.write( self._format_polygon(
+						points, layer, fill, stroke, stroke_width
+				) )
+
+
+		#------------------------------------------------------------------------
+
+		def _format_polygon( self, points, layer, fill, stroke, stroke_width ):
+
 				if fill:
-						self._write_polygon_filled(
+						return self._format_polygon_filled(
 								points, layer, stroke_width
 						)
 
 				# Polygons with a fill and stroke are drawn with the filled polygon
 				# above:
-				if stroke and not fill:
-
-						self._write_polygon_outline(
+				if stroke:
+						return self._format_polygon_outline(
 								points, layer, stroke_width
 						)
 
+				return ""
+
+
+		#------------------------------------------------------------------------
+
+		def _write_instance( self, name, reference, tstamp, layer, anchor, body ):
+
+				# The module goes on the side of its polygons:
+				side = layer.split( "." )[ 0 ]
+
+				label_size = self._convert_decimil_to_mm( 600 )
+				label_pen = self._convert_decimil_to_mm( 120 )
+
+				self.output_file.write( """
+(module {0} (layer {1}.Cu) (tedit 0) (tstamp {2:08X})
+  (at {3} {4})
+  (fp_text reference {5} (at 0 0) (layer {1}.SilkS) hide
+    (effects (font (size {6} {6}) (thickness {7})))
+  )
+  (fp_text value {8} (at 0 0) (layer {1}.SilkS) hide
+    (effects (font (size {6} {6}) (thickness {7})))
+  ){9}
+)""".format(
+		name, #0
+		side, #1
+		tstamp, #2
+		self._format_coordinate( anchor.x ), #3
+		self._format_coordinate( anchor.y ), #4
+		reference, #5
+		label_size, #6
+		label_pen, #7
+		self.imported.module_value, #8
+		body, #9
+)
+				)
+
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_footer( self, layer, stroke_width ):
+		def _format_polygon_footer( self, layer, stroke_width ):
 
-				self.output_file.write(
-						"    )\n    (layer {})\n    (width {})\n  )".format(
-								layer, stroke_width
-						)
+				return "    )\n    (layer {})\n    (width {})\n  )".format(
+						layer, stroke_width
 				)
 
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_header( self, points, layer ):
+		def _format_polygon_header( self, points, layer ):
 
-						self.output_file.write( "\n  (fp_poly\n    (pts \n" )
+				return "\n  (fp_poly\n    (pts \n"
 
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_point( self, point ):
+		def _format_polygon_points( self, points ):
 
-						self.output_file.write(
-								"      (xy {} {})\n".format( point.x, point.y )
-						)
+				# Format every coordinate first, then render the whole (pts ...)
+				# block with a single format call:
+				format_coordinate = self._format_coordinate
+				coordinates = []
+				for point in points:
+						coordinates.append( format_coordinate( point.x ) )
+						coordinates.append( format_coordinate( point.y ) )
+
+				return ( "      (xy {} {})\n" * len( points ) ).format( *coordinates )
 
 
 		#------------------------------------------------------------------------
 
-		def _write_polygon_segment( self, p, q, layer, stroke_width ):
+		def _format_polygon_segment( self, p, q, layer, stroke_width ):
 
-				self.output_file.write(
-						"""\n  (fp_line
+				return """\n  (fp_line
 		(start {} {})
 		(end {} {})
 		(layer {})
 		(width {})
 	)""".format(
-		p.x, p.y,
-		q.x, q.y,
+		self._format_coordinate( p.x ), self._format_coordinate( p.y ),
+		self._format_coordinate( q.x ), self._format_coordinate( q.y ),
 		layer,
 		stroke_width,
 )
-				)
 
 		#------------------------------------------------------------------------
 
-		def _write_edgecut_segment( self, p, q, layer, stroke_width ):
+		def _format_edgecut_segment( self, p, q, layer, stroke_width ):
 
-				self.output_file.write(
-						"""\n  (gr_line
+				return """\n  (gr_line
 		(start {} {})
 		(end {} {})
 		(layer {})
 		(width {})
 	)""".format(
-		p.x, p.y,
-		q.x, q.y,
+		self._format_coordinate( p.x ), self._format_coordinate( p.y ),
+		self._format_coordinate( q.x ), self._format_coordinate( q.y ),
 		layer,
 		stroke_width,
 )
-				)
 
 
 		#------------------------------------------------------------------------
@@ -1292,6 +1729,97 @@ def get_arguments():
 				default = 10.0,
 		)
 
+		parser.add_argument(
+				'--flatten',
+				type = str,
+				dest = 'flatten',
+				metavar = 'MODE',
+				choices = [ 'uniform', 'adaptive' ],
+				help = "curve approximation: uniform (according to PRECISION) or adaptive (according to TOLERANCE) (uniform|adaptive)",
+				default = 'uniform',
+		)
+
+		parser.add_argument(
+				'--tolerance',
+				type = float,
+				dest = 'tolerance',
+				metavar = 'TOLERANCE',
+				help = "maximum distance between curves and their approximation in mm, for adaptive flattening (float)",
+				default = 0.01,
+		)
+
+		parser.add_argument(
+				'--simplify',
+				type = float,
+				dest = 'simplify',
+				metavar = 'TOLERANCE_MM',
+				help = "remove the points of flattened outlines which are closer than this to the simplified outline, in mm (float)",
+				default = None,
+		)
+
+		parser.add_argument(
+				'--vw-area',
+				type = float,
+				dest = 'vw_area',
+				metavar = 'AREA_MM2',
+				help = "remove the polygon vertices whose triangle with their neighbours is smaller than this, in mm2 (float)",
+				default = None,
+		)
+
+		parser.add_argument(
+				'--max-vertices',
+				type = int,
+				dest = 'max_vertices',
+				metavar = 'COUNT',
+				help = "remove the polygon vertices with the smallest triangles until each polygon has at most this many (int)",
+				default = None,
+		)
+
+		parser.add_argument(
+				'--merge-layers',
+				dest = 'merge_layers',
+				action = 'store_const',
+				const = True,
+				help = "merge the overlapping filled polygons of each layer into their union",
+				default = False,
+		)
+
+		parser.add_argument(
+				'--nm-grid',
+				dest = 'nm_grid',
+				action = 'store_const',
+				const = True,
+				help = "snap polygons to KiCad's 1 nm grid, and compute on integers (mm units only)",
+				default = False,
+		)
+
+		parser.add_argument(
+				'--coord-precision',
+				type = int,
+				dest = 'coord_precision',
+				metavar = 'DIGITS',
+				help = "number of decimals written for coordinates, in mm (int)",
+				default = 6,
+		)
+
+		parser.add_argument(
+				'--instance-shapes',
+				dest = 'instance_shapes',
+				action = 'store_const',
+				const = True,
+				help = "write the paths drawn more than once (translated) as a module placed at each copy: faster, but each copy adds a module header (about 300 bytes) to the file",
+				default = False,
+		)
+
+		parser.add_argument(
+				'--validate',
+				dest = 'validate',
+				action = 'store_const',
+				const = True,
+				help = "report the filled polygons which intersect themselves, by SVG id",
+				default = False,
+		)
+
 		parser.add_argument(
 				'--front-only',
 				dest = 'front_only',
@@ -1337,7 +1865,8 @@ def get_arguments():
 
 #----------------------------------------------------------------------------
 #print "ok"
-main()
+if __name__ == "__main__":
+		main()
 
 
 #----------------------------------------------------------------------------